@@ -0,0 +1,533 @@
+"""Бенчмарки журнала на синтетических данных.
+
+Генератор пишет journal_data.json, teachers_data.json и одноразовый secret.key
+во временный каталог; замеры выполняются в отдельном процессе, запущенном в
+этом каталоге, чтобы не трогать рабочие файлы журнала.
+
+Результаты выводятся в JSON (--output сохраняет их в файл), два прогона
+сравниваются командой compare.
+
+Примеры:
+    python benchmark.py suite --students 2000 --output before.json
+    python benchmark.py timings --students 5000 --repeat 5
+    python benchmark.py timings --students 5000 --record-encryption
+    python benchmark.py memory --students 5000 --subjects 20 --pairs 100
+    python benchmark.py stress --workers 8 --writes 25 --readers 2 --wal
+    python benchmark.py serve --storage sqlite --requests 50
+    python benchmark.py compare before.json after.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from cryptography.fernet import Fernet
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Все синтетические пользователи получают один пароль: PBKDF2 считается один раз
+BENCH_PASSWORD = 'bench'
+BENCH_SALT = bytes(32)
+BENCH_ITERATIONS = 100000
+
+FIRST_NAMES = ['Иван', 'Петр', 'Анна', 'Мария', 'Олег', 'Елена', 'Сергей', 'Ольга']
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Волков']
+PATRONYMICS = ['Иванович', 'Петрович', 'Сергеевна', 'Олегович', 'Андреевна']
+
+
+def generate_journal(directory: str, students: int = 1000, subjects: int = 10, pairs: int = 50,
+                     grade_density: float = 0.5, teachers: int = 5, seed: int = 0,
+                     record_encryption: bool = False) -> dict:
+    """Записывает синтетический журнал заданного размера в directory.
+
+    grade_density - доля студентов, получающих оценку на каждой паре.
+    record_encryption - имена одним токеном на запись вместо токена на поле.
+    Возвращает параметры генерации и размер файла журнала (для отчета).
+    """
+    rng = random.Random(seed)
+    key = Fernet.generate_key()
+    cipher = Fernet(key)
+    hashed_password = hashlib.pbkdf2_hmac('sha256', BENCH_PASSWORD.encode(), BENCH_SALT, BENCH_ITERATIONS)
+    credentials = {'salt': BENCH_SALT.hex(), 'iterations': BENCH_ITERATIONS, 'hashed_password': hashed_password.hex()}
+
+    def person(login: str) -> dict:
+        names = (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), rng.choice(PATRONYMICS))
+        if record_encryption:
+            encrypted = {'names': cipher.encrypt(json.dumps(names, ensure_ascii=False, separators=(',', ':')).encode()).decode()}
+        else:
+            encrypted = {field: cipher.encrypt(value.encode()).decode()
+                         for field, value in zip(('first_name', 'last_name', 'patronymic'), names)}
+        return {'login': login, 'data': {**encrypted, **credentials}}
+
+    student_records = []
+    for i in range(students):
+        record = person(f'student{i}')
+        record['serial_number'] = i + 1
+        student_records.append(record)
+    logins = [s['login'] for s in student_records]
+
+    start = datetime(2024, 9, 1, 9, 0)
+    subject_records = []
+    for i in range(subjects):
+        pair_records = []
+        for j in range(pairs):
+            graded = rng.sample(logins, int(len(logins) * grade_density))
+            pair_records.append({
+                'date': (start + timedelta(days=j, hours=i % 8)).isoformat(),
+                'topic': f'Тема {j + 1}',
+                'grades': {login: rng.randint(2, 5) for login in graded},
+                'absentees': rng.sample(logins, min(len(logins), 2))
+            })
+        subject_records.append({'name': f'Предмет {i + 1}', 'pairs': pair_records, 'final_grades': {}})
+
+    with open(os.path.join(directory, 'secret.key'), 'wb') as f:
+        f.write(key)
+    with open(os.path.join(directory, 'journal_data.json'), 'w') as f:
+        json.dump({'group': 'bench', 'course': '1', 'students': student_records, 'subjects': subject_records},
+                  f, indent=2, ensure_ascii=False)
+    with open(os.path.join(directory, 'teachers_data.json'), 'w') as f:
+        json.dump([person(f'teacher{i}') for i in range(teachers)], f, indent=2, ensure_ascii=False)
+
+    return {'students': students, 'subjects': subjects, 'pairs': pairs,
+            'grade_density': grade_density, 'teachers': teachers, 'seed': seed,
+            'record_encryption': record_encryption,
+            'journal_bytes': os.path.getsize(os.path.join(directory, 'journal_data.json'))}
+
+
+def _rss_bytes() -> int:
+    """Текущий резидентный размер процесса (RSS) в байтах."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource  # Нет /proc: берем пиковое значение
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure_memory_child(compact_grades: bool, trace: bool):
+    """Выполняется в каталоге с данными: память до и после загрузки журнала.
+
+    Без trace замеряется RSS; с trace - объем Python-объектов через tracemalloc
+    (удерживаемый после загрузки и пиковый), который не зависит от фрагментации кучи.
+    """
+    sys.path.insert(0, REPO_DIR)
+    import gc
+    import tracemalloc
+    import index
+
+    if trace:
+        tracemalloc.start()
+        journal = index.Journal(compact_grades=compact_grades)
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        result = {'retained_bytes': retained, 'peak_bytes': peak}
+    else:
+        rss_before = _rss_bytes()
+        journal = index.Journal(compact_grades=compact_grades)
+        rss_after = _rss_bytes()
+        result = {'rss_before': rss_before, 'rss_after': rss_after, 'rss_delta': rss_after - rss_before}
+    result['students'] = len(journal.students)
+    result['pairs'] = sum(len(s.pairs) for s in journal.subjects)
+    print(json.dumps(result))
+
+
+def _run_child(directory: str, *args) -> dict:
+    """Запускает служебную команду бенчмарка в каталоге с данными и разбирает ее JSON-вывод."""
+    command = [sys.executable, os.path.abspath(__file__), *args]
+    output = subprocess.run(command, cwd=directory, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_memory(directory: str, compact_grades: bool = False) -> dict:
+    """Замеряет память до и после создания Journal() в отдельных процессах."""
+    flags = ['--compact-grades'] if compact_grades else []
+    result = _run_child(directory, '_memory-child', *flags)
+    result.update(_run_child(directory, '_memory-child', '--trace', *flags))
+    return result
+
+
+def _time(func, repeat: int) -> dict:
+    """Время выполнения func в секундах: минимум, медиана и среднее по repeat запускам."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return {'min': min(samples), 'median': statistics.median(samples), 'mean': statistics.mean(samples)}
+
+
+def _measure_timings_child(repeat: int):
+    """Выполняется в каталоге с данными: время основных операций журнала.
+
+    Сначала замеряются операции чтения, затем изменяющие файлы журнала.
+    """
+    sys.path.insert(0, REPO_DIR)
+    start = time.perf_counter()
+    import index
+    elapsed = time.perf_counter() - start  # Холодный импорт возможен один раз на процесс
+    result = {'import': {'min': elapsed, 'median': elapsed, 'mean': elapsed}}
+
+    result['journal_init'] = _time(index.Journal, repeat)
+    journal = index.Journal()
+    student = journal.students[0]
+    teacher = journal.teachers[0]
+    subject = journal.subjects[0].name
+
+    result['login_student'] = _time(lambda: journal.login(student.login, BENCH_PASSWORD), repeat)
+    result['login_teacher'] = _time(lambda: journal.login(teacher.login, BENCH_PASSWORD), repeat)
+
+    journal.current_user = student
+    result['show_grades'] = _time(journal.show_grades, repeat)
+    result['show_grades_detailed'] = _time(lambda: journal.show_grades(detailed=True), repeat)
+    result['show_schedule'] = _time(journal.show_schedule, repeat)
+
+    def roster_cold():
+        index.Person.name_cache.clear()
+        journal.roster()
+
+    result['roster_cold'] = _time(roster_cold, repeat)
+    result['roster_warm'] = _time(journal.roster, repeat)
+
+    # Поиск по фамилии без кеша имен: перебором с расшифровкой и по слепому индексу
+    last_name = student.last_name
+    indexed = index.Journal(name_index=True)
+
+    def find_students(target):
+        index.Person.name_cache.clear()
+        target.find_students(last_name=last_name)
+
+    result['find_students_scan'] = _time(lambda: find_students(journal), repeat)
+    result['find_students_indexed'] = _time(lambda: find_students(indexed), repeat)
+
+    result['save_data'] = _time(journal._save_data, repeat)
+    journal.current_user = teacher
+    result['add_grade'] = _time(lambda: journal.add_grade(student.login, subject, 5), repeat)
+    wal_journal = index.Journal(use_wal=True)
+    wal_journal.current_user = wal_journal.get_teacher(teacher.login)
+    result['add_grade_wal'] = _time(lambda: wal_journal.add_grade(student.login, subject, 4), repeat)
+    print(json.dumps(result))
+
+
+def measure_timings(directory: str, repeat: int = 3) -> dict:
+    """Замеряет время операций журнала в отдельном процессе (вывод журнала отбрасывается)."""
+    return _run_child(directory, '_timings-child', '--repeat', str(repeat))
+
+
+def _environment() -> dict:
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def compare(before: dict, after: dict) -> dict:
+    """Отношение времени after/before по каждой операции (по медиане); меньше 1 - быстрее."""
+    result = {}
+    for name, timing in after.get('timings', {}).items():
+        old = before.get('timings', {}).get(name)
+        if old and old['median']:
+            result[name] = round(timing['median'] / old['median'], 3)
+    for key in ('memory', 'memory_compact_grades'):
+        if key in before and key in after and before[key].get('retained_bytes'):
+            result[f'{key}.retained_bytes'] = round(after[key]['retained_bytes'] / before[key]['retained_bytes'], 3)
+    return result
+
+
+STRESS_SUBJECT = 'Предмет 1'
+STRESS_DONE = 'stress.done'  # Создается, когда все пишущие процессы завершились
+
+
+def _stress_grade(worker: int, k: int) -> int:
+    return 2 + (worker + k) % 4
+
+
+def _stress_child(worker: int, writes: int, wal: bool):
+    """Выполняется в каталоге с данными: один преподаватель выставляет writes оценок
+    своим студентам (у каждого процесса свои) и добавляет одного студента."""
+    sys.path.insert(0, REPO_DIR)
+    import index
+
+    start = time.perf_counter()
+    journal = index.Journal(use_wal=wal)
+    journal.current_user = journal.get_teacher('teacher0')
+    for k in range(writes):
+        journal.add_grade(f'student{worker * writes + k}', STRESS_SUBJECT, _stress_grade(worker, k))
+    journal.add_student({'first_name': 'Стресс', 'last_name': 'Тестов', 'patronymic': str(worker),
+                         'login': f'stress{worker}', 'password': BENCH_PASSWORD})
+    print(json.dumps({'worker': worker, 'seconds': time.perf_counter() - start}))
+
+
+def _stress_check_child(workers: int, writes: int):
+    """Выполняется в каталоге с данными: проверяет, что ни одна запись процессов не потеряна."""
+    sys.path.insert(0, REPO_DIR)
+    import index
+
+    journal = index.Journal()
+    last_pair = journal.get_subject(STRESS_SUBJECT).latest_pair()
+    lost_grades = [
+        f'student{worker * writes + k}'
+        for worker in range(workers) for k in range(writes)
+        if last_pair.grades.get(f'student{worker * writes + k}') != _stress_grade(worker, k)
+    ]
+    lost_students = [f'stress{w}' for w in range(workers) if journal.get_student(f'stress{w}') is None]
+    print(json.dumps({'lost_grades': lost_grades, 'lost_students': lost_students,
+                      'version': journal._log_seq}, ensure_ascii=False))
+
+
+def _stress_reader_child():
+    """Выполняется в каталоге с данными: пока пишут процессы нагрузки, журнал раз за разом
+    открывается заново, так что загрузка попадает на дописывание журнала изменений.
+
+    Версия загруженного журнала не должна уменьшаться, а недописанных строк
+    читатель видеть не должен: запись и загрузка идут под одной блокировкой.
+    """
+    sys.path.insert(0, REPO_DIR)
+    import contextlib
+    import io
+    import index
+
+    loads, version, regressions, torn = 0, 0, 0, 0
+    while not os.path.exists(STRESS_DONE):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            journal = index.Journal()
+        loads += 1
+        regressions += journal._log_seq < version
+        version = max(version, journal._log_seq)
+        torn += 'обрывается' in output.getvalue() or 'Поврежденная строка' in output.getvalue()
+    print(json.dumps({'loads': loads, 'regressions': regressions, 'torn_lines': torn}))
+
+
+def stress(directory: str, workers: int, writes: int, wal: bool, readers: int = 0) -> dict:
+    """Запускает workers процессов, одновременно пишущих в один журнал, и проверяет результат.
+
+    readers процессов в это время заново открывают журнал (см. _stress_reader_child).
+    """
+    script = os.path.abspath(__file__)
+    command = [sys.executable, script, '_stress-child', '--writes', str(writes)]
+    if wal:
+        command.append('--wal')
+    start = time.perf_counter()
+    reader_processes = [
+        subprocess.Popen([sys.executable, script, '_stress-reader'], cwd=directory, stdout=subprocess.PIPE, text=True)
+        for _ in range(readers)
+    ]
+    processes = [
+        subprocess.Popen(command + ['--worker', str(w)], cwd=directory, stdout=subprocess.PIPE, text=True)
+        for w in range(workers)
+    ]
+    try:
+        for process in processes:
+            process.communicate()
+            if process.returncode:
+                raise RuntimeError(f'Процесс нагрузки завершился с кодом {process.returncode}')
+    finally:
+        open(os.path.join(directory, STRESS_DONE), 'w').close()
+        reader_outputs = [process.communicate()[0] for process in reader_processes]
+    result = {'seconds': time.perf_counter() - start}
+    for process, output in zip(reader_processes, reader_outputs):
+        if process.returncode:
+            raise RuntimeError(f'Читающий процесс завершился с кодом {process.returncode}')
+    result['readers'] = [json.loads(output.strip().splitlines()[-1]) for output in reader_outputs]
+    result.update(_run_child(directory, '_stress-check', '--workers', str(workers), '--writes', str(writes)))
+    result['ok'] = (not result['lost_grades'] and not result['lost_students']
+                    and not any(r['regressions'] or r['torn_lines'] for r in result['readers']))
+    return result
+
+
+def serve(directory: str, storage: str, requests: int) -> dict:
+    """Запускает index.py serve для журнала группы в формате storage и проходит по адресам сервера.
+
+    Проверяются коды ответов и то, что выставленная оценка видна студенту; время -
+    по requests запросов add_grade и show_grades.
+    """
+    import http.client
+    import socket
+
+    script = os.path.join(REPO_DIR, 'index.py')
+    if storage != 'json':
+        subprocess.run([sys.executable, script, 'convert', '--group', 'bench', '--course', '1', '--to', storage],
+                       cwd=directory, check=True, capture_output=True)
+    with socket.socket() as sock:  # Свободный порт
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([sys.executable, script, 'serve', '--group', 'bench', '--course', '1',
+                               '--port', str(port)], cwd=directory, stdout=subprocess.PIPE, text=True)
+    errors = []
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('Сервер журнала не запустился')
+                time.sleep(0.1)
+
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+        def request(method, path, body=None, token=None, expected=200):
+            headers = {'Content-Type': 'application/json'}
+            if token:
+                headers['Authorization'] = 'Bearer ' + token
+            connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = connection.getresponse()
+            payload = json.loads(response.read())
+            if response.status != expected:
+                errors.append({'request': f'{method} {path}', 'status': response.status, 'response': payload})
+            return payload
+
+        teacher = request('POST', '/login', {'login': 'teacher0', 'password': BENCH_PASSWORD}).get('token')
+        student = request('POST', '/login', {'login': 'student0', 'password': BENCH_PASSWORD}).get('token')
+        request('POST', '/add_pair', {'subject': STRESS_SUBJECT, 'date': '2030-01-01T09:00:00', 'topic': 'serve'},
+                teacher)
+        add_grade, show_grades = [], []
+        for k in range(requests):
+            start = time.perf_counter()
+            request('POST', '/add_grade', {'login': 'student0', 'subject': STRESS_SUBJECT, 'grade': 2 + k % 4}, teacher)
+            add_grade.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            grades = request('GET', '/show_grades', token=student).get('grades', {})
+            show_grades.append(time.perf_counter() - start)
+            if grades.get(STRESS_SUBJECT) != 2 + k % 4:
+                errors.append({'request': 'GET /show_grades', 'grades': grades})
+        detailed = request('GET', '/show_grades?detailed=1', token=student).get('grades', {})
+        if not isinstance(detailed.get(STRESS_SUBJECT), dict):
+            errors.append({'request': 'GET /show_grades?detailed=1', 'grades': detailed})
+        request('GET', '/show_schedule', token=student)
+        for bad_grade in (True, 4.9, '5', 101):
+            request('POST', '/add_grade', {'login': 'student0', 'subject': STRESS_SUBJECT, 'grade': bad_grade}, teacher,
+                    expected=400)
+        connection.close()
+    finally:
+        server.terminate()
+        server.communicate()
+    return {'storage': storage, 'add_grade_median': statistics.median(add_grade) if requests else None,
+            'show_grades_median': statistics.median(show_grades) if requests else None,
+            'errors': errors[:10], 'ok': not errors}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in (('suite', 'Время операций и память на синтетическом журнале'),
+                            ('timings', 'Время загрузки, сохранения, входа и запросов журнала'),
+                            ('memory', 'Память до и после загрузки синтетического журнала')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--students', type=int, default=2000)
+        command.add_argument('--subjects', type=int, default=10)
+        command.add_argument('--pairs', type=int, default=100)
+        command.add_argument('--grade-density', type=float, default=0.5)
+        command.add_argument('--seed', type=int, default=0)
+        command.add_argument('--output', help='Файл для результата в JSON')
+        command.add_argument('--record-encryption', action='store_true', help='Имена одним токеном на запись')
+        if name != 'memory':
+            command.add_argument('--repeat', type=int, default=3, help='Повторов каждой операции')
+
+    compare_parser = commands.add_parser('compare', help='Сравнить два результата (отношение времени after/before)')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+
+    stress_parser = commands.add_parser('stress', help='Одновременная запись оценок из нескольких процессов')
+    stress_parser.add_argument('--workers', type=int, default=8)
+    stress_parser.add_argument('--writes', type=int, default=25, help='Оценок на процесс')
+    stress_parser.add_argument('--wal', action='store_true', help='Писать через журнал изменений')
+    stress_parser.add_argument('--readers', type=int, default=2,
+                               help='Процессов, заново открывающих журнал во время записи')
+
+    serve_parser = commands.add_parser('serve', help='Запросы к HTTP-серверу журнала группы (index.py serve)')
+    serve_parser.add_argument('--storage', choices=('json', 'binary', 'sqlite'), default='sqlite')
+    serve_parser.add_argument('--requests', type=int, default=20, help='Запросов add_grade и show_grades')
+
+    child = commands.add_parser('_memory-child')
+    child.add_argument('--compact-grades', action='store_true')
+    child.add_argument('--trace', action='store_true')
+
+    timings_child = commands.add_parser('_timings-child')
+    timings_child.add_argument('--repeat', type=int, required=True)
+
+    stress_child = commands.add_parser('_stress-child')
+    stress_child.add_argument('--worker', type=int, required=True)
+    stress_child.add_argument('--writes', type=int, required=True)
+    stress_child.add_argument('--wal', action='store_true')
+
+    commands.add_parser('_stress-reader')
+
+    stress_check = commands.add_parser('_stress-check')
+    stress_check.add_argument('--workers', type=int, required=True)
+    stress_check.add_argument('--writes', type=int, required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == '_memory-child':
+        _measure_memory_child(args.compact_grades, args.trace)
+        return
+    if args.command == '_stress-child':
+        _stress_child(args.worker, args.writes, args.wal)
+        return
+    if args.command == '_stress-reader':
+        _stress_reader_child()
+        return
+    if args.command == '_stress-check':
+        _stress_check_child(args.workers, args.writes)
+        return
+    if args.command == '_timings-child':
+        _measure_timings_child(args.repeat)
+        return
+    if args.command == 'compare':
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        print(json.dumps(compare(before, after), indent=2, ensure_ascii=False))
+        return
+
+    if args.command == 'stress':
+        with tempfile.TemporaryDirectory() as directory:
+            # У каждого процесса свои студенты, оценок до начала теста нет
+            params = generate_journal(directory, students=args.workers * args.writes, subjects=2, pairs=5,
+                                      grade_density=0, seed=0)
+            result = stress(directory, args.workers, args.writes, args.wal, args.readers)
+            result = {'params': params, 'wal': args.wal, **result}
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        if not result['ok']:
+            sys.exit(1)
+        return
+
+    if args.command == 'serve':
+        with tempfile.TemporaryDirectory() as directory:
+            params = generate_journal(directory, students=50, subjects=2, pairs=5, seed=0)
+            result = {'params': params, **serve(directory, args.storage, args.requests)}
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        if not result['ok']:
+            sys.exit(1)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        params = generate_journal(directory, args.students, args.subjects, args.pairs,
+                                  args.grade_density, seed=args.seed, record_encryption=args.record_encryption)
+        result = {'params': params, 'environment': _environment()}
+        if args.command in ('suite', 'timings'):
+            # Замеры памяти идут раньше: операции записи меняют файлы журнала
+            if args.command == 'suite':
+                result['memory'] = measure_memory(directory)
+                result['memory_compact_grades'] = measure_memory(directory, compact_grades=True)
+            result['timings'] = measure_timings(directory, args.repeat)
+        else:
+            result['memory'] = measure_memory(directory)
+            result['memory_compact_grades'] = measure_memory(directory, compact_grades=True)
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,68 @@
+import atexit
+import base64
+import bisect
+import csv
+import functools
 import hashlib
+import hmac
+import io
 import json
+import mmap
 import os
+import secrets
+import struct
+import sys
+import threading
+import time
 import getpass
-from datetime import datetime
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from http import HTTPStatus
 
-from cryptography.fernet import Fernet
+# Тяжелые модули (cryptography, numpy, asyncio, sqlite3, argparse, concurrent.futures)
+# импортируются при первом использовании: импорт index.py и запуск коротких
+# скриптов не платят за то, что им не нужно.
+
+try:
+    import fcntl  # Блокировки файлов в Linux и macOS
+except ImportError:
+    fcntl = None
+    import msvcrt  # Windows
+
+
+_numpy_module = False  # False - еще не импортировался, None - NumPy не установлен
+
+
+def _numpy():
+    """Возвращает модуль numpy (импорт при первом обращении) или None, если он не установлен."""
+    global _numpy_module
+    if _numpy_module is False:
+        try:
+            import numpy  # Необязательная зависимость: векторная аналитика по предметам
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = None
+    return _numpy_module
 
 
 # --- Инициализация шифрования ---
-def crypto_init():
-    """Инициализирует шифрование Fernet."""
-    key_file_path = 'secret.key'
+KEY_FILE_PATH = os.environ.get('JOURNAL_KEY_FILE', 'secret.key')
+
+
+def crypto_init(key_file_path: str = None):
+    """Инициализирует шифрование Fernet.
+
+    Файл ключей содержит по ключу в строке. Новые данные шифруются первым ключом,
+    остальные (прежние, см. rotate_key) используются только для расшифровки.
+    По умолчанию используется KEY_FILE_PATH (см. set_key_file).
+    """
+    from cryptography.fernet import Fernet, MultiFernet
+
+    key_file_path = key_file_path or KEY_FILE_PATH
     if not os.path.exists(key_file_path):
         key = Fernet.generate_key()
         with open(key_file_path, 'wb') as key_file:
@@ -18,12 +70,33 @@ def crypto_init():
 
     try:
         with open(key_file_path, 'rb') as key_file:
-            return Fernet(key_file.read())
+            return MultiFernet([Fernet(key) for key in key_file.read().split()])
     except IOError as e:
         print(f"Ошибка при чтении файла ключа: {e}")
         return None  # Или другое значение по умолчанию, чтобы указать на ошибку
 
-cipher = crypto_init()
+cipher = None  # Создается при первом шифровании или дешифровании (get_cipher)
+_cipher_lock = threading.Lock()
+
+
+def get_cipher():
+    """Возвращает шифр, при первом вызове читая (или создавая) файл ключей."""
+    global cipher
+    if cipher is None:
+        with _cipher_lock:  # Пулы потоков не должны создать файл ключей дважды
+            if cipher is None:
+                cipher = crypto_init()
+    return cipher
+
+
+def set_key_file(path: str):
+    """Задает путь к файлу ключей; шифр будет загружен заново при следующем обращении."""
+    global KEY_FILE_PATH, cipher, _name_index_key
+    KEY_FILE_PATH = path
+    cipher = None
+    _name_index_key = None
+    Person.name_cache.clear()
+
 
 class EncryptionHelper:
     """Вспомогательный класс для шифрования и дешифрования данных."""
@@ -31,6 +104,7 @@ class EncryptionHelper:
     @staticmethod
     def encrypt(data: str) -> bytes:
         """Шифрует строку с использованием Fernet."""
+        cipher = get_cipher()
         if cipher:
             return cipher.encrypt(data.encode())
         else:
@@ -40,122 +114,851 @@ class EncryptionHelper:
     @staticmethod
     def decrypt(encrypted_data: bytes) -> str:
         """Дешифрует зашифрованные данные с использованием Fernet."""
+        cipher = get_cipher()
         if cipher:
             return cipher.decrypt(encrypted_data).decode()
         else:
             print("Ошибка: Шифрование не инициализировано.")
             return encrypted_data.decode() # Возвращаем зашифрованные данные (для отладки или обработки ошибок)
 
+    # Меньшие пакеты обрабатываются в текущем потоке: накладные расходы пула больше выигрыша
+    PARALLEL_MIN_ITEMS = 256
+    _pool = None
+
+    @staticmethod
+    def encrypt_many(items: list, workers: int = None) -> list:
+        """Шифрует список строк; результаты возвращаются в исходном порядке."""
+        return EncryptionHelper._map(EncryptionHelper.encrypt, items, workers)
+
+    @staticmethod
+    def rotate(token: bytes) -> bytes:
+        """Перешифровывает токен основным (первым) ключом, сохраняя его время создания."""
+        return get_cipher().rotate(token)
+
+    @staticmethod
+    def rotate_many(tokens: list, workers: int = None) -> list:
+        """Перешифровывает список токенов основным ключом; результаты в исходном порядке."""
+        return EncryptionHelper._map(EncryptionHelper.rotate, tokens, workers)
+
+    @staticmethod
+    def decrypt_many(tokens: list, workers: int = None) -> list:
+        """Дешифрует список токенов; результаты возвращаются в исходном порядке."""
+        return EncryptionHelper._map(EncryptionHelper.decrypt, tokens, workers)
+
+    @staticmethod
+    def _map(func, items: list, workers: int = None) -> list:
+        """Применяет func ко всем элементам, при необходимости распределяя части по пулу потоков.
+
+        Криптографический бэкенд отпускает GIL, поэтому потоки работают параллельно.
+        """
+        items = list(items)
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        if workers <= 1 or len(items) < EncryptionHelper.PARALLEL_MIN_ITEMS:
+            return [func(item) for item in items]
+
+        if EncryptionHelper._pool is None or EncryptionHelper._pool._max_workers < workers:
+            from concurrent.futures import ThreadPoolExecutor
+            EncryptionHelper._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crypto')
+        # Крупные непрерывные части вместо отдельной задачи на каждый элемент
+        size = -(-len(items) // workers)
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        results = []
+        for part in EncryptionHelper._pool.map(lambda chunk: [func(item) for item in chunk], chunks):
+            results.extend(part)
+        return results
+
+class NameCache:
+    """Ограниченный LRU-кеш расшифрованных имен (ключ - шифротекст).
+
+    Избавляет от повторной расшифровки Fernet при каждом чтении full_name.
+    Кеш хранит открытый текст, поэтому его следует очищать при выходе пользователя.
+    Journal увеличивает размер под число токенов загруженных людей (fit), чтобы
+    последовательный обход списка группы не вытеснял сам себя.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.fixed = False  # Размер задан явно (resize): fit его не меняет
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, token: bytes) -> str:
+        """Возвращает расшифрованное значение, расшифровывая его только при промахе."""
+        try:
+            value = self._data[token]
+        except KeyError:
+            value = EncryptionHelper.decrypt(token)
+            self.put(token, value)
+            return value
+        self._data.move_to_end(token)
+        return value
+
+    def put(self, token: bytes, value: str):
+        """Кладет значение в кеш, вытесняя давно не использованные записи."""
+        if self.maxsize <= 0:
+            return
+        self._data[token] = value
+        self._data.move_to_end(token)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get_many(self, tokens: list) -> list:
+        """Возвращает расшифрованные значения списка токенов; промахи расшифровываются одним пакетом."""
+        missing = [t for t in dict.fromkeys(tokens) if t not in self._data]
+        decrypted = dict(zip(missing, EncryptionHelper.decrypt_many(missing)))
+        values = []
+        for token in tokens:
+            value = decrypted.get(token)
+            if value is None:
+                value = self._data[token]
+                self._data.move_to_end(token)
+            values.append(value)
+        for token, value in decrypted.items():
+            self.put(token, value)
+        return values
+
+    def resize(self, maxsize: int):
+        """Задает размер кеша (0 отключает кеширование); автоматический рост (fit) отключается."""
+        self.maxsize = maxsize
+        self.fixed = True
+        while len(self._data) > max(maxsize, 0):
+            self._data.popitem(last=False)
+
+    def fit(self, tokens: int):
+        """Увеличивает кеш, чтобы в нем помещались tokens имен (размер, заданный resize, не меняется)."""
+        if not self.fixed and tokens > self.maxsize:
+            self.maxsize = tokens
+
+    def clear(self):
+        """Удаляет все расшифрованные значения из памяти."""
+        self._data.clear()
+
+NAME_FIELDS = ('first_name', 'last_name', 'patronymic')  # Зашифрованные поля имени в записях пользователей
+
+# --- Слепой индекс имен ---
+# Метки HMAC позволяют искать по имени без расшифровки: равные (после нормализации)
+# значения дают равные метки, а сами значения по меткам не восстанавливаются.
+NAME_INDEX_FIELDS = NAME_FIELDS
+NAME_INDEX_PREFIX_MAX = 4  # Длиннее префиксы ищутся по первым символам и проверяются расшифровкой
+NAME_INDEX_TAG_SIZE = 16  # Шестнадцатеричных символов метки; редкие совпадения отсеиваются расшифровкой
+NAME_INDEX_KEY_SUFFIX = '.index'  # Ключ HMAC хранится рядом с файлом ключей шифрования
+_name_index_key = None
+
+
+def name_index_key() -> bytes:
+    """Возвращает ключ HMAC слепого индекса, при первом вызове читая (или создавая) его файл.
+
+    Ключ отделен от ключей Fernet, поэтому ротация (rotate_key) не меняет метки.
+    """
+    global _name_index_key
+    if _name_index_key is None:
+        with _cipher_lock:
+            if _name_index_key is None:
+                key_path = KEY_FILE_PATH + NAME_INDEX_KEY_SUFFIX
+                if not os.path.exists(key_path):
+                    with open(key_path, 'wb') as key_file:
+                        key_file.write(secrets.token_hex(32).encode())
+                with open(key_path, 'rb') as key_file:
+                    _name_index_key = bytes.fromhex(key_file.read().decode().strip())
+    return _name_index_key
+
+
+def normalize_name(value: str) -> str:
+    """Приводит имя к виду для поиска: без пробелов по краям, без учета регистра, ё = е."""
+    return value.strip().casefold().replace('ё', 'е')
+
+
+def name_tag(field: str, kind: str, value: str) -> str:
+    """Метка HMAC нормализованного значения поля; kind - 'exact' или 'prefix'."""
+    message = f"{field}\x00{kind}\x00{value}".encode()
+    return hmac.new(name_index_key(), message, hashlib.sha256).hexdigest()[:NAME_INDEX_TAG_SIZE]
+
+
+def name_tags(names: dict) -> dict:
+    """Метки полей имени {поле: [точная метка, метки префиксов 1..NAME_INDEX_PREFIX_MAX]}."""
+    tags = {}
+    for field in NAME_INDEX_FIELDS:
+        value = normalize_name(names[field] or '')
+        tags[field] = [name_tag(field, 'exact', value)] + [
+            name_tag(field, 'prefix', value[:size]) for size in range(1, min(len(value), NAME_INDEX_PREFIX_MAX) + 1)
+        ]
+    return tags
+
 # --- Классы ---
 
 class Person:
-    """Базовый класс для представления человека (студента или преподавателя)."""
+    """Базовый класс для представления человека (студента или преподавателя).
 
-    def __init__(self, first_name: str, last_name: str, patronymic: str):
-        self._first_name = EncryptionHelper.encrypt(first_name)
-        self._last_name = EncryptionHelper.encrypt(last_name)
-        self._patronymic = EncryptionHelper.encrypt(patronymic)
+    Имя хранится зашифрованным: тремя токенами Fernet (по полю) или, при
+    record_encryption=True, одним токеном на все поля - втрое меньше операций
+    шифрования и накладных расходов на токены в файлах.
+    """
+
+    __slots__ = ('_first_name', '_last_name', '_patronymic', '_names', '_name_index')
+
+    name_cache = NameCache()  # Общий кеш расшифрованных имен
+
+    def __init__(self, first_name: str, last_name: str, patronymic: str, record_encryption: bool = False):
+        if record_encryption:
+            self._names = EncryptionHelper.encrypt(self._join_names((first_name, last_name, patronymic)))
+            self._first_name = self._last_name = self._patronymic = None
+        else:
+            self._names = None  # Один токен на все поля (record_encryption)
+            self._first_name = EncryptionHelper.encrypt(first_name)
+            self._last_name = EncryptionHelper.encrypt(last_name)
+            self._patronymic = EncryptionHelper.encrypt(patronymic)
+        self._name_index = None  # Метки слепого индекса (build_name_index)
+
+    @staticmethod
+    def _join_names(values) -> str:
+        """Открытый текст общего токена: поля имени в порядке NAME_FIELDS."""
+        return json.dumps(list(values), ensure_ascii=False, separators=(',', ':'))
+
+    def _name_tokens(self) -> tuple:
+        """Токены имени: один общий или по одному на поле."""
+        if self._names is not None:
+            return (self._names,)
+        return (self._first_name, self._last_name, self._patronymic)
+
+    def _name_values(self) -> tuple:
+        """Расшифрованные (имя, фамилия, отчество)."""
+        if self._names is not None:
+            return tuple(json.loads(self.name_cache.get(self._names)))
+        return tuple(self.name_cache.get(token) for token in self._name_tokens())
 
     @property
     def full_name(self) -> str:
         """Возвращает полное имя человека."""
-        return f"{self.last_name} {self.first_name} {self.patronymic}"
+        first_name, last_name, patronymic = self._name_values()
+        return f"{last_name} {first_name} {patronymic}"
 
     @property
     def first_name(self) -> str:
         """Возвращает имя человека."""
-        return EncryptionHelper.decrypt(self._first_name)
+        if self._names is not None:
+            return self._name_values()[0]
+        return self.name_cache.get(self._first_name)
 
     @property
     def last_name(self) -> str:
         """Возвращает фамилию человека."""
-        return EncryptionHelper.decrypt(self._last_name)
+        if self._names is not None:
+            return self._name_values()[1]
+        return self.name_cache.get(self._last_name)
 
     @property
     def patronymic(self) -> str:
         """Возвращает отчество человека."""
-        return EncryptionHelper.decrypt(self._patronymic)
+        if self._names is not None:
+            return self._name_values()[2]
+        return self.name_cache.get(self._patronymic)
+
+    @classmethod
+    def names_many(cls, people: list, cache: bool = True) -> list:
+        """Возвращает (имя, фамилия, отчество) списка людей, расшифровывая недостающие токены одним пакетом.
+
+        cache=False расшифровывает все токены, не заполняя кеш имен (для массовой выгрузки).
+        """
+        tokens = []
+        for person in people:
+            tokens.extend(person._name_tokens())
+        values = iter(cls.name_cache.get_many(tokens) if cache else EncryptionHelper.decrypt_many(tokens))
+        return [
+            tuple(json.loads(next(values))) if person._names is not None else (next(values), next(values), next(values))
+            for person in people
+        ]
+
+    @classmethod
+    def full_names(cls, people: list) -> list:
+        """Возвращает полные имена списка людей, расшифровывая недостающие поля одним пакетом."""
+        return [f"{last_name} {first_name} {patronymic}" for first_name, last_name, patronymic in cls.names_many(people)]
 
     def get_fio(self) -> str:
         """Возвращает ФИО"""
         return self.full_name
 
+    def build_name_index(self, names: dict = None):
+        """Вычисляет метки слепого индекса имени.
+
+        names - открытые значения полей (при создании человека); без них поля расшифровываются.
+        """
+        if names is None:
+            names = {field: getattr(self, field) for field in NAME_INDEX_FIELDS}
+        self._name_index = name_tags(names)
+
+    def _restore_names(self, data: dict):
+        """Восстанавливает зашифрованные поля имени из сохраненной записи (без расшифровки).
+
+        Записи с общим токеном хранят его в поле names, прежние - три поля.
+        """
+        if 'names' in data:
+            self._names = data['names'].encode()
+            self._first_name = self._last_name = self._patronymic = None
+        else:
+            self._names = None
+            self._first_name = data['first_name'].encode()
+            self._last_name = data['last_name'].encode()
+            self._patronymic = data['patronymic'].encode()
+        self._name_index = data.get('name_index')
+
+    def _names_to_dict(self) -> dict:
+        """Возвращает зашифрованные поля имени (и метки слепого индекса) в виде, пригодном для JSON."""
+        if self._names is not None:
+            names = {'names': self._names.decode()}
+        else:
+            names = {
+                'first_name': self._first_name.decode(),
+                'last_name': self._last_name.decode(),
+                'patronymic': self._patronymic.decode()
+            }
+        if self._name_index is not None:
+            names['name_index'] = self._name_index
+        return names
+
+# Число итераций PBKDF2 для новых паролей. Хранится в записи пользователя рядом с солью,
+# поэтому изменение значения не ломает уже сохраненные хеши.
+PBKDF2_ITERATIONS = 100000
+
+
+def hash_password(password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS) -> bytes:
+    """Хеширует пароль с использованием PBKDF2-SHA256."""
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+
+def verify_password(password: str, salt: bytes, hashed_password: bytes, iterations: int) -> bool:
+    """Проверяет пароль; сравнение хешей выполняется за постоянное время.
+
+    Функция уровня модуля, чтобы ее можно было передать в пул процессов.
+    """
+    return hmac.compare_digest(hash_password(password, salt, iterations), hashed_password)
+
+
+class PasswordVerifier:
+    """Пул для параллельной проверки паролей.
+
+    hashlib.pbkdf2_hmac отпускает GIL, поэтому по умолчанию достаточно пула потоков;
+    use_processes=True переносит хеширование в отдельные процессы.
+    """
+
+    def __init__(self, workers: int = None, use_processes: bool = False):
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self._executor = None
+
+    @property
+    def executor(self):
+        """Создает пул при первом обращении."""
+        if self._executor is None:
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+            pool_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+            self._executor = pool_class(max_workers=self.workers)
+        return self._executor
+
+    def submit(self, user, password: str):
+        """Запускает проверку пароля пользователя в пуле и возвращает Future."""
+        return self.executor.submit(
+            verify_password, password, user._salt, user._hashed_password, user._iterations
+        )
+
+    async def verify_async(self, user, password: str) -> bool:
+        """Проверяет пароль в пуле, не блокируя цикл событий."""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, verify_password, password, user._salt, user._hashed_password, user._iterations
+        )
+
+    def hash_many(self, passwords: list, iterations: int = PBKDF2_ITERATIONS) -> list:
+        """Хеширует пароли новых пользователей параллельно. Возвращает [(соль, хеш)] в исходном порядке."""
+        salts = [os.urandom(32) for _ in passwords]
+        hashes = self.executor.map(hash_password, passwords, salts, [iterations] * len(passwords))
+        return list(zip(salts, hashes))
+
+    def shutdown(self):
+        """Останавливает пул."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 class User:
-    """Класс для представления пользователя с логином и паролем."""
+    """Класс для представления пользователя с логином и паролем.
+
+    Используется как примесь к Person: слоты с учетными данными (USER_SLOTS)
+    объявляют наследники, иначе при множественном наследовании возникает
+    конфликт раскладки слотов.
+    """
+
+    __slots__ = ()
+    USER_SLOTS = ('login', '_salt', '_iterations', '_hashed_password')
 
     def __init__(self, login: str, password: str):
         """Инициализирует пользователя, хеширует пароль."""
         self.login = login
         self._salt = os.urandom(32)
+        self._iterations = PBKDF2_ITERATIONS
         self._hashed_password = self._hash_password(password)
 
     def _hash_password(self, password: str) -> bytes:
         """Хеширует пароль с использованием PBKDF2."""
-        return hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode(),
-            self._salt,
-            100000
-        )
+        return hash_password(password, self._salt, self._iterations)
 
     def check_password(self, password: str) -> bool:
         """Проверяет, соответствует ли введенный пароль хешированному паролю."""
-        return self._hash_password(password) == self._hashed_password
+        return verify_password(password, self._salt, self._hashed_password, self._iterations)
+
+    def _restore_credentials(self, login: str, data: dict):
+        """Восстанавливает логин, соль и хеш пароля из сохраненной записи (без PBKDF2)."""
+        self.login = login
+        self._salt = bytes.fromhex(data['salt'])
+        self._hashed_password = bytes.fromhex(data['hashed_password'])
+        # Старые записи без числа итераций созданы со значением 100000
+        self._iterations = data.get('iterations', 100000)
+
+    def _credentials_to_dict(self) -> dict:
+        """Возвращает соль, число итераций и хеш пароля в виде, пригодном для JSON."""
+        return {
+            'salt': self._salt.hex(),
+            'iterations': self._iterations,
+            'hashed_password': self._hashed_password.hex()
+        }
 
 
 class Student(Person, User):
     """Класс для представления студента."""
 
-    def __init__(self, first_name: str, last_name: str, patronymic: str, login: str, password: str, serial_number: int = None):
+    __slots__ = User.USER_SLOTS + ('serial_number',)
+
+    def __init__(self, first_name: str, last_name: str, patronymic: str, login: str, password: str, serial_number: int = None,
+                 record_encryption: bool = False):
         """Инициализирует студента."""
-        Person.__init__(self, first_name, last_name, patronymic)
+        Person.__init__(self, first_name, last_name, patronymic, record_encryption)
         User.__init__(self, login, password)
         self.serial_number = serial_number  # Порядковый номер
 
+    @classmethod
+    def from_record(cls, login: str, data: dict, serial_number: int = None):
+        """Создает студента из сохраненной записи: имя остается зашифрованным до первого обращения."""
+        student = cls.__new__(cls)
+        student._restore_names(data)
+        student._restore_credentials(login, data)
+        student.serial_number = serial_number
+        return student
+
+    def to_record(self) -> dict:
+        """Возвращает запись студента для сохранения."""
+        return {
+            'login': self.login,
+            'data': {**self._names_to_dict(), **self._credentials_to_dict()},
+            'serial_number': self.serial_number
+        }
+
     def __repr__(self):
         return f"Student(serial_number={self.serial_number}, full_name='{self.full_name}')"
 
 class Teacher(Person, User):
     """Класс для представления преподавателя."""
 
-    def __init__(self, first_name: str, last_name: str, patronymic: str, login: str, password: str, salt: bytes = None, hashed_password: bytes = None):
+    __slots__ = User.USER_SLOTS
+
+    def __init__(self, first_name: str, last_name: str, patronymic: str, login: str, password: str, salt: bytes = None, hashed_password: bytes = None,
+                 record_encryption: bool = False):
         """Инициализирует преподавателя."""
-        super().__init__(first_name, last_name, patronymic)
+        super().__init__(first_name, last_name, patronymic, record_encryption)
         User.__init__(self, login, password)
         if salt is not None:
             self._salt = salt
         if hashed_password is not None:
             self._hashed_password = hashed_password
 
+    @classmethod
+    def from_record(cls, login: str, data: dict):
+        """Создает преподавателя из сохраненной записи: имя остается зашифрованным до первого обращения."""
+        teacher = cls.__new__(cls)
+        teacher._restore_names(data)
+        teacher._restore_credentials(login, data)
+        return teacher
+
+    def to_record(self) -> dict:
+        """Возвращает запись преподавателя для сохранения."""
+        return {
+            'login': self.login,
+            'data': {**self._names_to_dict(), **self._credentials_to_dict()}
+        }
+
+
+# Допустимые оценки: проверяются при вводе (add_grade, импорт); помещаются в array('h') GradeStore
+MIN_GRADE = 0
+MAX_GRADE = 100
+
+
+def valid_grade(grade) -> bool:
+    return isinstance(grade, int) and not isinstance(grade, bool) and MIN_GRADE <= grade <= MAX_GRADE
+
+
+class GradeAggregate:
+    """Накопительные показатели студента по одному предмету."""
+
+    __slots__ = ('count', 'total', 'weighted_total', 'weight_total', 'absences', 'pairs')
+
+    def __init__(self):
+        self.count = 0  # Количество оценок
+        self.total = 0  # Сумма оценок
+        self.weighted_total = 0  # Сумма оценок с учетом веса пар
+        self.weight_total = 0  # Сумма весов пар с оценками
+        self.absences = 0  # Количество пропусков
+        self.pairs = []  # Пары, на которых студент получил оценку (обратный индекс для истории)
+
+    def __repr__(self):
+        return (f"GradeAggregate(count={self.count}, total={self.total}, "
+                f"weighted_average={self.weighted_average}, absences={self.absences})")
+
+    def add_grade(self, grade: int, weight: float):
+        self.count += 1
+        self.total += grade
+        self.weighted_total += grade * weight
+        self.weight_total += weight
+
+    def remove_grade(self, grade: int, weight: float):
+        self.count -= 1
+        self.total -= grade
+        self.weighted_total -= grade * weight
+        self.weight_total -= weight
+
+    @property
+    def average(self):
+        """Среднее арифметическое оценок или None, если оценок нет."""
+        return self.total / self.count if self.count else None
+
+    @property
+    def weighted_average(self):
+        """Средневзвешенная оценка или None, если оценок нет."""
+        return self.weighted_total / self.weight_total if self.weight_total else None
+
+
+class GradeStore:
+    """Компактное (столбцовое) хранилище оценок и пропусков одного предмета.
+
+    Логины студентов заменяются целочисленными номерами столбцов, оценки каждой пары
+    хранятся в типизированном массиве array('h'), пропуски - в битовой маске (int).
+    """
+
+    MISSING = -32768  # Значение "нет оценки" в массиве
+
+    def __init__(self):
+        self.slots = {}  # {student_login: номер столбца}
+        self.logins = []  # [student_login] по номерам столбцов
+        self.rows = []  # [array('h')] по номерам пар
+        self.absences = []  # [int] - битовые маски отсутствующих по номерам пар
+
+    def slot(self, login: str) -> int:
+        """Возвращает номер столбца студента, выделяя новый при необходимости."""
+        slot = self.slots.get(login)
+        if slot is None:
+            slot = self.slots[login] = len(self.logins)
+            self.logins.append(login)
+        return slot
+
+    def add_row(self, grades: dict, absentees) -> int:
+        """Добавляет строку пары и возвращает ее номер."""
+        row = len(self.rows)
+        self.rows.append(array('h'))
+        self.absences.append(0)
+        for login, grade in grades.items():
+            self.set(row, login, grade)
+        for login in absentees:
+            self.set_absent(row, login)
+        return row
+
+    def get(self, row: int, login: str):
+        """Возвращает оценку или None."""
+        slot = self.slots.get(login)
+        values = self.rows[row]
+        if slot is None or slot >= len(values) or values[slot] == self.MISSING:
+            return None
+        return values[slot]
+
+    def set(self, row: int, login: str, grade):
+        """Записывает оценку (None удаляет ее)."""
+        if grade is not None and not self.MISSING < grade <= 32767:
+            raise ValueError(f"Оценка {grade} не помещается в компактное хранилище")
+        slot = self.slot(login)
+        values = self.rows[row]
+        if slot >= len(values):
+            values.extend([self.MISSING] * (slot + 1 - len(values)))
+        values[slot] = self.MISSING if grade is None else grade
+
+    def set_absent(self, row: int, login: str):
+        self.absences[row] |= 1 << self.slot(login)
+
+    def clear_absent(self, row: int, login: str):
+        slot = self.slots.get(login)
+        if slot is not None:
+            self.absences[row] &= ~(1 << slot)
+
+    def is_absent(self, row: int, login: str) -> bool:
+        slot = self.slots.get(login)
+        return slot is not None and bool(self.absences[row] >> slot & 1)
+
+    def absent_logins(self, row: int) -> list:
+        mask = self.absences[row]
+        return [login for slot, login in enumerate(self.logins) if mask >> slot & 1]
+
+    def matrix(self):
+        """Матрица оценок пары x студент (NumPy, пропуски - NaN) или None без NumPy."""
+        np = _numpy()
+        if np is None:
+            return None
+        result = np.full((len(self.rows), len(self.logins)), np.nan)
+        for i, values in enumerate(self.rows):
+            if values:
+                row = np.frombuffer(values, dtype=np.int16).astype(float)
+                row[row == self.MISSING] = np.nan
+                result[i, :len(row)] = row
+        return result
+
+    def averages(self) -> dict:
+        """Средняя оценка каждого студента по всем парам."""
+        matrix = self.matrix()
+        if matrix is not None:
+            np = _numpy()
+            counts = np.sum(~np.isnan(matrix), axis=0)
+            sums = np.nansum(matrix, axis=0)
+            return {
+                login: float(sums[slot] / counts[slot])
+                for slot, login in enumerate(self.logins) if counts[slot]
+            }
+        sums = [0] * len(self.logins)
+        counts = [0] * len(self.logins)
+        for values in self.rows:
+            for slot, grade in enumerate(values):
+                if grade != self.MISSING:
+                    sums[slot] += grade
+                    counts[slot] += 1
+        return {login: sums[slot] / counts[slot] for slot, login in enumerate(self.logins) if counts[slot]}
+
+    def absence_counts(self) -> dict:
+        """Количество пропусков каждого студента по всем парам."""
+        counts = [0] * len(self.logins)
+        for mask in self.absences:
+            slot = 0
+            while mask:
+                if mask & 1:
+                    counts[slot] += 1
+                mask >>= 1
+                slot += 1
+        return {login: counts[slot] for slot, login in enumerate(self.logins) if counts[slot]}
+
+
+class GradeRowView(MutableMapping):
+    """Представление оценок одной пары из GradeStore в виде словаря {student_login: grade}."""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store: GradeStore, row: int):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, login):
+        grade = self._store.get(self._row, login)
+        if grade is None:
+            raise KeyError(login)
+        return grade
+
+    def __setitem__(self, login, grade):
+        self._store.set(self._row, login, grade)
+
+    def __delitem__(self, login):
+        self[login]  # KeyError, если оценки нет
+        self._store.set(self._row, login, None)
+
+    def __iter__(self):
+        logins = self._store.logins
+        missing = GradeStore.MISSING
+        return (logins[slot] for slot, grade in enumerate(self._store.rows[self._row]) if grade != missing)
+
+    def __len__(self):
+        missing = GradeStore.MISSING
+        return sum(1 for grade in self._store.rows[self._row] if grade != missing)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class AbsenteesView:
+    """Представление пропусков одной пары из GradeStore в виде списка логинов."""
+
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store: GradeStore, row: int):
+        self._store = store
+        self._row = row
+
+    def __contains__(self, login):
+        return self._store.is_absent(self._row, login)
+
+    def __iter__(self):
+        return iter(self._store.absent_logins(self._row))
+
+    def __len__(self):
+        return bin(self._store.absences[self._row]).count('1')
+
+    def __repr__(self):
+        return repr(self._store.absent_logins(self._row))
+
+    def append(self, login: str):
+        self._store.set_absent(self._row, login)
+
+    def remove(self, login: str):
+        if login not in self:
+            raise ValueError(f"{login} не отмечен отсутствующим")
+        self._store.clear_absent(self._row, login)
 
 
 class Subject:
     """Класс, представляющий учебный предмет."""
-    def __init__(self, name: str):
+    __slots__ = ('name', 'pairs', 'final_grades', 'aggregates', 'store', '_latest')
+
+    def __init__(self, name: str, compact: bool = False):
         self.name = name
         self.pairs = []
+        self._latest = None  # Последняя по дате пара (пары могут добавляться не по порядку дат)
         self.final_grades = {}  # {student_login: grade}
+        self.aggregates = {}  # {student_login: GradeAggregate}, обновляются при каждой оценке
+        # В компактном режиме оценки и пропуски всех пар хранятся в одном GradeStore
+        self.store = GradeStore() if compact else None
 
     def __repr__(self):
         return f"Subject(name='{self.name}')"
 
     def add_pair(self, pair):
         """Добавить пару к предмету"""
+        pair._subject = self
+        if self.store is not None:
+            row = self.store.add_row(pair.grades, pair.absentees)
+            pair.grades = GradeRowView(self.store, row)
+            pair.absentees = AbsenteesView(self.store, row)
         self.pairs.append(pair)
+        if self._latest is None or pair.date >= self._latest.date:
+            self._latest = pair
+        for login, grade in pair.grades.items():
+            aggregate = self._aggregate(login)
+            aggregate.add_grade(grade, pair.weight)
+            aggregate.pairs.append(pair)
+        for login in pair.absentees:
+            self._aggregate(login).absences += 1
 
-    def calculate_final_grades(self):
-        """Рассчитать итоговые оценки (заглушка)"""
-        print(f"Расчет итоговых оценок для предмета {self.name} (пока не реализовано)")
+    def _aggregate(self, login: str) -> GradeAggregate:
+        """Возвращает (создавая при необходимости) показатели студента."""
+        aggregate = self.aggregates.get(login)
+        if aggregate is None:
+            aggregate = self.aggregates[login] = GradeAggregate()
+        return aggregate
 
+    def _on_grade_changed(self, pair, login: str, old_grade, new_grade: int):
+        """Учитывает новую (или исправленную) оценку в показателях студента."""
+        aggregate = self._aggregate(login)
+        if old_grade is not None:
+            aggregate.remove_grade(old_grade, pair.weight)
+        else:
+            aggregate.pairs.append(pair)
+        aggregate.add_grade(new_grade, pair.weight)
 
+    def grade_history(self, login: str) -> list:
+        """Оценки студента по предмету: [(пара, оценка)] в порядке дат.
 
-class Pair:  
+        Берется из обратного индекса, поэтому время зависит только от числа оценок
+        самого студента, а не от числа пар предмета.
+        """
+        aggregate = self.aggregates.get(login)
+        if aggregate is None:
+            return []
+        return sorted(((pair, pair.grades[login]) for pair in aggregate.pairs), key=lambda entry: entry[0].date)
+
+    def remove_student(self, login: str):
+        """Удаляет оценки, пропуски, итоговую оценку и показатели студента."""
+        aggregate = self.aggregates.pop(login, None)
+        self.final_grades.pop(login, None)
+        if aggregate is None:
+            return
+        for pair in aggregate.pairs:
+            del pair.grades[login]
+        if aggregate.absences:
+            for pair in self.pairs:
+                if login in pair.absentees:
+                    pair.absentees.remove(login)
+
+    def find_pair(self, date: datetime):
+        """Найти пару по дате (поиск с конца, т.к. обычно нужна одна из последних пар)"""
+        for pair in reversed(self.pairs):
+            if pair.date == date:
+                return pair
+        return None
+
+    def latest_pair(self):
+        """Последняя по дате пара или None (за O(1): обновляется в add_pair).
+
+        Из пар с одной датой берется добавленная позже, как и в find_pair.
+        """
+        return self._latest
+
+    def to_dict(self) -> dict:
+        """Возвращает предмет в виде, пригодном для JSON."""
+        return {
+            'name': self.name,
+            'pairs': [p.to_dict() for p in self.pairs],
+            'final_grades': self.final_grades
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, compact: bool = False):
+        """Создает предмет из сохраненной записи."""
+        subject = cls(data['name'], compact=compact)
+        for p in data['pairs']:
+            subject.add_pair(Pair.from_dict(p))
+        subject.final_grades = data['final_grades']
+        return subject
+
+    def calculate_final_grades(self) -> dict:
+        """Рассчитать итоговые оценки по накопленным показателям.
+
+        Итоговая оценка - средневзвешенная оценка, округленная до целого (0.5 вверх).
+        Работает за O(число студентов), не обходя оценки всех пар.
+        """
+        self.final_grades = {
+            login: int(aggregate.weighted_average + 0.5)
+            for login, aggregate in self.aggregates.items()
+            if aggregate.weight_total
+        }
+        return self.final_grades
+
+    def grade_matrix(self):
+        """Матрица оценок пары x студент (только в компактном режиме и при наличии NumPy)."""
+        return self.store.matrix() if self.store is not None else None
+
+    def student_averages(self) -> dict:
+        """Средняя оценка каждого студента (в компактном режиме - векторно по хранилищу)."""
+        if self.store is not None:
+            return self.store.averages()
+        return {login: a.average for login, a in self.aggregates.items() if a.count}
+
+
+
+class Pair:
     """Класс, представляющий пару (занятие) по предмету."""
-    def __init__(self, date: datetime, topic: str, grades: dict = None, absentees: list = None):
+    __slots__ = ('date', 'topic', 'grades', 'absentees', 'weight', '_subject')
+
+    def __init__(self, date: datetime, topic: str, grades: dict = None, absentees: list = None, weight: float = 1):
         self.date = date
         self.topic = topic
         self.grades = grades if grades is not None else {}  # {student_login: grade}
         self.absentees = absentees if absentees is not None else []  # [student_login]
+        self.weight = weight  # Вес оценок пары в итоговой оценке
+        self._subject = None  # Предмет, показатели которого обновляются при выставлении оценок
 
     def __repr__(self):
         return f"Pair(date={self.date.isoformat()}, topic='{self.topic}')"
@@ -170,7 +973,41 @@ class Pair:
 
     def set_grade(self, student_login: str, grade: int):
         """Поставить оценку студенту"""
+        old_grade = self.grades.get(student_login)
         self.grades[student_login] = grade
+        if self._subject is not None:
+            self._subject._on_grade_changed(self, student_login, old_grade, grade)
+
+    def mark_absent(self, student_login: str):
+        """Отметить студента отсутствующим"""
+        if student_login in self.absentees:
+            return
+        self.absentees.append(student_login)
+        if self._subject is not None:
+            self._subject._aggregate(student_login).absences += 1
+
+    def to_dict(self) -> dict:
+        """Возвращает пару в виде, пригодном для JSON."""
+        data = {
+            'date': self.date.isoformat(),
+            'topic': self.topic,
+            'grades': dict(self.grades),
+            'absentees': list(self.absentees)
+        }
+        if self.weight != 1:
+            data['weight'] = self.weight
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Создает пару из сохраненной записи."""
+        return cls(
+            date=datetime.fromisoformat(data['date']),
+            topic=data['topic'],
+            grades=data.get('grades', {}),  # Используем .get(), чтобы избежать KeyError, если нет ключа
+            absentees=data.get('absentees', []),  # Аналогично для absentees
+            weight=data.get('weight', 1)
+        )
 
     def display_pair_info(self):
         """Вывод информации о паре"""
@@ -187,11 +1024,965 @@ class SubjectPair:
         self.teacher = new_teacher
 
 
+class ScheduleIndex:
+    """Расписание группы, упорядоченное по дате пары.
+
+    Даты лежат в отсортированном списке, поэтому пары за период или ближайшие
+    пары находятся бинарным поиском (bisect), без обхода всех предметов и пар.
+    Дата в формате ISO вычисляется один раз, при добавлении пары.
+    """
+
+    __slots__ = ('dates', 'entries')
+
+    def __init__(self):
+        self.dates = []  # Даты пар по возрастанию
+        self.entries = []  # (предмет, дата ISO, тема) на тех же позициях
+
+    def rebuild(self, subjects):
+        """Строит индекс заново по всем парам предметов (после загрузки журнала)."""
+        items = sorted(
+            ((pair.date, subject.name, pair.date.isoformat(), pair.topic) for subject in subjects for pair in subject.pairs),
+            key=lambda item: item[0]
+        )
+        self.dates = [item[0] for item in items]
+        self.entries = [item[1:] for item in items]
+
+    def add(self, subject_name: str, pair):
+        """Вставляет пару на ее место; пары с одинаковой датой идут в порядке добавления."""
+        position = bisect.bisect_right(self.dates, pair.date)
+        self.dates.insert(position, pair.date)
+        self.entries.insert(position, (subject_name, pair.date.isoformat(), pair.topic))
+
+    def between(self, start: datetime = None, end: datetime = None, limit: int = None) -> list:
+        """Пары с start <= дата < end (границы необязательны), не больше limit первых."""
+        low = bisect.bisect_left(self.dates, start) if start is not None else 0
+        high = bisect.bisect_left(self.dates, end) if end is not None else len(self.dates)
+        if limit is not None:
+            high = min(high, low + limit)
+        return self.entries[low:high]
+
+
+class NameIndex:
+    """Слепой индекс имен студентов или преподавателей: метка HMAC -> логины.
+
+    Поиск по имени - поиск метки в словаре, без расшифровки всех записей;
+    расшифровываются только найденные кандидаты (для проверки и вывода).
+    """
+
+    __slots__ = ('tags',)
+
+    def __init__(self):
+        self.tags = {}
+
+    def rebuild(self, people) -> int:
+        """Строит индекс заново. Метки записей, сохраненных без них, вычисляются
+        с пакетной расшифровкой имен; возвращает число таких записей."""
+        self.tags = {}
+        missing = [person for person in people if person._name_index is None]
+        for person, values in zip(missing, Person.names_many(missing)):
+            person.build_name_index(dict(zip(NAME_FIELDS, values)))
+        for person in people:
+            self.add(person)
+        return len(missing)
+
+    def add(self, person):
+        if person._name_index is None:
+            person.build_name_index()
+        for tags in person._name_index.values():
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(person.login)
+
+    def remove(self, person):
+        for tags in (person._name_index or {}).values():
+            for tag in tags:
+                logins = self.tags.get(tag)
+                if logins is not None:
+                    logins.discard(person.login)
+                    if not logins:
+                        del self.tags[tag]
+
+    def lookup(self, field: str, value: str, prefix: bool = False) -> set:
+        """Логины-кандидаты, у которых поле равно value (или начинается с него при prefix=True).
+
+        Возможны лишние кандидаты (усеченные метки, префикс длиннее NAME_INDEX_PREFIX_MAX),
+        поэтому результат проверяется по расшифрованным значениям.
+        """
+        value = normalize_name(value)
+        if prefix:
+            tag = name_tag(field, 'prefix', value[:NAME_INDEX_PREFIX_MAX])
+        else:
+            tag = name_tag(field, 'exact', value)
+        return set(self.tags.get(tag, ()))
+
+
+class _JsonStream:
+    """Чтение JSON из файла по частям: значения разбираются по одному, без загрузки всего дерева."""
+
+    CHUNK_SIZE = 64 * 1024
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, f):
+        self._f = f
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size: int = CHUNK_SIZE) -> bool:
+        """Дочитывает очередную часть файла в буфер. Возвращает False в конце файла."""
+        chunk = self._f.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Возвращает следующий значимый символ, пропуская пробелы."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise json.JSONDecodeError("Неожиданный конец файла", self._buf, self._pos)
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Ожидался символ '{char}'", self._buf, self._pos)
+        self._pos += 1
+
+    def value(self):
+        """Разбирает одно JSON-значение целиком (например, один элемент массива)."""
+        self.peek()
+        size = self.CHUNK_SIZE
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                # Значение не уместилось в буфер: дочитываем все большими частями
+                if not self._fill(size):
+                    raise
+                size *= 2
+                continue
+            if end == len(self._buf) and not self._eof and self._fill(size):
+                continue  # Число на границе буфера могло быть обрезано
+            self._pos = end
+            return value
+
+
+def _iter_json_object(f, stream_keys=()):
+    """Обходит JSON-объект верхнего уровня, не загружая его целиком.
+
+    Для ключей из stream_keys (массивов) выдает пары (ключ, элемент) по одному элементу,
+    для остальных ключей - пары (ключ, значение).
+    """
+    stream = _JsonStream(f)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key in stream_keys and stream.peek() == '[':
+            stream.expect('[')
+            if stream.peek() != ']':
+                while True:
+                    yield key, stream.value()
+                    if stream.peek() != ',':
+                        break
+                    stream.expect(',')
+            stream.expect(']')
+        else:
+            yield key, stream.value()
+        if stream.peek() != ',':
+            break
+        stream.expect(',')
+    stream.expect('}')
+
+
+def _chunked(iterable, size: int):
+    """Разбивает поток на списки не длиннее size, не читая его целиком."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def file_lock(path: str):
+    """Рекомендательная (advisory) блокировка файла path на время блока with.
+
+    Ждет, пока блокировку не отпустит другой процесс. Блокируют друг друга только
+    процессы, которые тоже берут эту блокировку; сам файл данных не запирается.
+    """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK сдается через 10 секунд ожидания
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class _Section:
+    """Суммарное время участка, который за одно сохранение выполняется много раз
+    (кодирование записей, запись в файл); в статистику попадает одним замером."""
+    __slots__ = ('name', 'seconds', '_start')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self._start
+
+    def record(self):
+        instrumentation.record(self.name, self.seconds)
+
+
+class _NoSection:
+    """Заглушка _Section, когда инструментирование выключено."""
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+    def record(self):
+        pass
+
+
+_NO_SECTION = _NoSection()
+
+
+def _section(name: str):
+    """Замер участка сохранения (см. enable_instrumentation)."""
+    return _Section(name) if instrumentation is not None else _NO_SECTION
+
+
+def _write_json_atomic(path: str, data):
+    """Записывает JSON во временный файл и атомарно подменяет им исходный.
+
+    Сбой посреди записи не может оставить файл обрезанным: на диске остается
+    либо старая, либо новая версия целиком.
+    """
+    encode, write = _section('json.encode'), _section('io.write')
+    with encode:
+        text = json.dumps(data, indent=2, ensure_ascii=False)
+    tmp_path = path + '.tmp'
+    with write:
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    encode.record()
+    write.record()
+
+
+class StorageFormatError(ValueError):
+    """Файл хранилища поврежден или имеет неизвестный формат."""
+
+
+class JsonStorage:
+    """Хранение журнала в JSON-файлах (формат по умолчанию).
+
+    Снимок журнала пишется потоково, по одной записи студента или предмета на строку.
+    """
+
+    record_level = False  # Изменения сохраняются снимком (или через журнал изменений)
+
+    def __init__(self, data_path: str = 'journal_data.json', teachers_path: str = 'teachers_data.json'):
+        self.data_path = data_path
+        self.teachers_path = teachers_path
+        # Имена от полного имени файла: у журналов разных форматов свои журнал изменений и блокировка
+        self.log_path = data_path + '.log'
+        self.lock_path = data_path + '.lock'
+        self.teachers_lock_path = teachers_path + '.lock'
+        # Прежнее имя журнала изменений (journal_data.log), до появления других форматов - только JSON
+        self.legacy_log_path = os.path.splitext(data_path)[0] + '.log'
+
+    def iter_snapshot(self):
+        """Потоково выдает пары (ключ, значение) снимка; студенты и предметы - по одному.
+
+        Порядок: поля заголовка (group, course, log_seq), затем students, затем subjects.
+        """
+        with open(self.data_path, 'r') as f:
+            yield from _iter_json_object(f, ('students', 'subjects'))
+
+    def write_snapshot(self, header: dict, students, subjects):
+        """Атомарно записывает снимок; students и subjects могут быть генераторами."""
+        # Кодирование и запись чередуются по записям, время каждого участка суммируется за снимок
+        encode, write = _section('json.encode'), _section('io.write')
+        tmp_path = self.data_path + '.tmp'
+        with open(tmp_path, 'w') as out:
+            out.write('{\n')
+            for key, value in header.items():
+                out.write(f'  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n')
+            for key, values, tail in (('students', students, ',\n'), ('subjects', subjects, '\n')):
+                out.write(f'  "{key}": [')
+                first = True
+                for value in values:
+                    with encode:
+                        line = ('\n    ' if first else ',\n    ') + json.dumps(value, ensure_ascii=False)
+                    with write:
+                        out.write(line)
+                    first = False
+                out.write((']' if first else '\n  ]') + tail)
+            out.write('}\n')
+            with write:
+                out.flush()
+                os.fsync(out.fileno())
+        os.replace(tmp_path, self.data_path)
+        encode.record()
+        write.record()
+
+    def load_teachers(self) -> list:
+        with open(self.teachers_path, 'r') as f:
+            return json.load(f)
+
+    def save_teachers(self, records: list):
+        _write_json_atomic(self.teachers_path, records)
+
+
+class BinaryStorage:
+    """Компактный двоичный снимок журнала, читаемый через mmap.
+
+    Файл: сигнатура MAGIC и последовательность записей <тип: 1 байт><длина: uint32><данные>.
+    Записи студентов и преподавателей хранят шифротекст, соль и хеш сырыми байтами
+    (без base64/hex) и, если есть, метки слепого индекса имен (компактный JSON в конце
+    записи), предметы - компактным JSON. Типы записей: H - заголовок,
+    S - студент, T - преподаватель, J - предмет; s и t - студент и преподаватель
+    с именем одним токеном (record_encryption).
+    """
+
+    record_level = False
+    MAGIC = b'JRNLBIN1'
+    _RECORD = struct.Struct('<cI')
+
+    def __init__(self, data_path: str = 'journal_data.bin', teachers_path: str = 'teachers_data.bin',
+                 teachers_storage=None):
+        """teachers_storage - другое хранилище, из которого берутся преподаватели
+        (как в SqliteStorage: общий teachers_data.json для журналов групп)."""
+        self.data_path = data_path
+        self.teachers_storage = teachers_storage
+        if teachers_storage is not None:
+            teachers_path = teachers_storage.teachers_path
+        self.teachers_path = teachers_path
+        self.log_path = data_path + '.log'
+        self.lock_path = data_path + '.lock'
+        self.teachers_lock_path = (teachers_storage.teachers_lock_path if teachers_storage is not None
+                                   else teachers_path + '.lock')
+
+    # --- Кодирование записей ---
+
+    @staticmethod
+    def _pack_bytes(out: list, data: bytes):
+        out.append(struct.pack('<H', len(data)))
+        out.append(data)
+
+    @staticmethod
+    def _user_kind(record: dict, kind: bytes) -> bytes:
+        """Тип записи пользователя: строчная буква - имя одним токеном."""
+        return kind.lower() if 'names' in record['data'] else kind
+
+    @staticmethod
+    def _encode_user(record: dict, with_serial: bool) -> bytes:
+        data = record['data']
+        out = []
+        BinaryStorage._pack_bytes(out, record['login'].encode())
+        for field in ('names',) if 'names' in data else NAME_FIELDS:
+            BinaryStorage._pack_bytes(out, base64.urlsafe_b64decode(data[field]))
+        BinaryStorage._pack_bytes(out, bytes.fromhex(data['salt']))
+        BinaryStorage._pack_bytes(out, bytes.fromhex(data['hashed_password']))
+        out.append(struct.pack('<I', data.get('iterations', 100000)))
+        if with_serial:
+            serial_number = record.get('serial_number')
+            out.append(struct.pack('<i', -1 if serial_number is None else serial_number))
+        if 'name_index' in data:
+            BinaryStorage._pack_bytes(out, json.dumps(data['name_index'], separators=(',', ':')).encode())
+        return b''.join(out)
+
+    @staticmethod
+    def _decode_user(buf, pos: int, with_serial: bool, name_fields: tuple = NAME_FIELDS) -> dict:
+        fields = []
+        for _ in range(len(name_fields) + 3):
+            (size,) = struct.unpack_from('<H', buf, pos)
+            fields.append(buf[pos + 2:pos + 2 + size])
+            pos += 2 + size
+        login, *names, salt, hashed_password = fields
+        (iterations,) = struct.unpack_from('<I', buf, pos)
+        data = {field: base64.urlsafe_b64encode(value).decode() for field, value in zip(name_fields, names)}
+        data.update({
+            'salt': salt.hex(),
+            'iterations': iterations,
+            'hashed_password': hashed_password.hex()
+        })
+        record = {'login': login.decode(), 'data': data}
+        pos += 4
+        if with_serial:
+            (serial_number,) = struct.unpack_from('<i', buf, pos)
+            record['serial_number'] = None if serial_number < 0 else serial_number
+            pos += 4
+        if pos < len(buf):  # Записи без меток заканчиваются здесь
+            (size,) = struct.unpack_from('<H', buf, pos)
+            record['data']['name_index'] = json.loads(bytes(buf[pos + 2:pos + 2 + size]))
+        return record
+
+    # --- Чтение и запись файлов ---
+
+    def _iter_records(self, path: str):
+        """Выдает пары (тип, данные) записей файла, отображенного в память."""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < len(self.MAGIC):
+                raise StorageFormatError(f"Файл {path} пуст или обрезан")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if buf[:len(self.MAGIC)] != self.MAGIC:
+                    raise StorageFormatError(f"Файл {path} не является двоичным снимком журнала")
+                pos = len(self.MAGIC)
+                while pos < len(buf):
+                    if pos + self._RECORD.size > len(buf):
+                        raise StorageFormatError(f"Файл {path} обрезан")
+                    kind, size = self._RECORD.unpack_from(buf, pos)
+                    pos += self._RECORD.size
+                    if pos + size > len(buf):
+                        raise StorageFormatError(f"Файл {path} обрезан")
+                    yield kind, buf[pos:pos + size]
+                    pos += size
+
+    def _write_records(self, path: str, records, encode=_NO_SECTION):
+        """Атомарно записывает последовательность пар (тип, данные).
+
+        encode - замер кодирования записей в генераторе records (см. _section).
+        """
+        write = _section('io.write')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(self.MAGIC)
+            for kind, payload in records:
+                with write:
+                    out.write(self._RECORD.pack(kind, len(payload)))
+                    out.write(payload)
+            with write:
+                out.flush()
+                os.fsync(out.fileno())
+        os.replace(tmp_path, path)
+        encode.record()
+        write.record()
+
+    def iter_snapshot(self):
+        """Выдает пары (ключ, значение) снимка в том же виде, что и JsonStorage."""
+        for kind, payload in self._iter_records(self.data_path):
+            if kind == b'H':
+                yield from json.loads(payload).items()
+            elif kind == b'S':
+                yield 'students', self._decode_user(payload, 0, with_serial=True)
+            elif kind == b's':
+                yield 'students', self._decode_user(payload, 0, with_serial=True, name_fields=('names',))
+            elif kind == b'J':
+                yield 'subjects', json.loads(payload)
+
+    def write_snapshot(self, header: dict, students, subjects):
+        encode = _section('binary.encode')
+
+        def records():
+            yield b'H', json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode()
+            for record in students:
+                with encode:
+                    payload = self._encode_user(record, with_serial=True)
+                yield self._user_kind(record, b'S'), payload
+            for subject in subjects:
+                with encode:
+                    payload = json.dumps(subject, ensure_ascii=False, separators=(',', ':')).encode()
+                yield b'J', payload
+
+        self._write_records(self.data_path, records(), encode)
+
+    def load_teachers(self) -> list:
+        if self.teachers_storage is not None:
+            return self.teachers_storage.load_teachers()
+        teachers = []
+        for kind, payload in self._iter_records(self.teachers_path):
+            if kind == b'T':
+                teachers.append(self._decode_user(payload, 0, with_serial=False))
+            elif kind == b't':
+                teachers.append(self._decode_user(payload, 0, with_serial=False, name_fields=('names',)))
+        return teachers
+
+    def save_teachers(self, records: list):
+        if self.teachers_storage is not None:
+            self.teachers_storage.save_teachers(records)
+            return
+        self._write_records(self.teachers_path, (
+            (self._user_kind(r, b'T'), self._encode_user(r, with_serial=False)) for r in records
+        ))
+
+
+class SqliteStorage:
+    """Хранение журнала в локальной базе SQLite (без сервера).
+
+    В отличие от файловых хранилищ, изменения записываются построчно
+    (apply_records): выставление оценки - это одна вставка в таблицу grades.
+    Несколько процессов могут безопасно работать с одной базой.
+    """
+
+    record_level = True  # Изменения записываются по одному, без перезаписи снимка
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS students (
+            login TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, patronymic TEXT,
+            salt TEXT, iterations INTEGER, hashed_password TEXT, serial_number INTEGER, name_index TEXT, names TEXT);
+        CREATE TABLE IF NOT EXISTS teachers (
+            login TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, patronymic TEXT,
+            salt TEXT, iterations INTEGER, hashed_password TEXT, name_index TEXT, names TEXT);
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, final_grades TEXT NOT NULL DEFAULT '{}');
+        CREATE TABLE IF NOT EXISTS pairs (
+            id INTEGER PRIMARY KEY, subject_id INTEGER NOT NULL REFERENCES subjects(id),
+            date TEXT NOT NULL, topic TEXT, weight REAL NOT NULL DEFAULT 1);
+        CREATE TABLE IF NOT EXISTS grades (
+            pair_id INTEGER NOT NULL REFERENCES pairs(id), login TEXT NOT NULL, grade INTEGER NOT NULL,
+            PRIMARY KEY (pair_id, login));
+        CREATE TABLE IF NOT EXISTS absences (
+            pair_id INTEGER NOT NULL REFERENCES pairs(id), login TEXT NOT NULL,
+            PRIMARY KEY (pair_id, login));
+        CREATE INDEX IF NOT EXISTS pairs_by_subject ON pairs(subject_id, date);
+        CREATE INDEX IF NOT EXISTS pairs_by_date ON pairs(date);
+        CREATE INDEX IF NOT EXISTS grades_by_login ON grades(login);
+        CREATE INDEX IF NOT EXISTS absences_by_login ON absences(login);
+    """
+
+    # Пара определяется предметом и датой, как и в записях изменений
+    _PAIR_ID = ("(SELECT p.id FROM pairs p JOIN subjects s ON s.id = p.subject_id "
+                "WHERE s.name = ? AND p.date = ? ORDER BY p.id DESC LIMIT 1)")
+    _USER_FIELDS = ('first_name', 'last_name', 'patronymic', 'salt', 'iterations', 'hashed_password')
+
+    @staticmethod
+    def _user_values(data: dict) -> tuple:
+        name_index = data.get('name_index')
+        # Имя одним токеном (record_encryption) хранится в names, поля имени при этом пусты
+        return (data.get('first_name'), data.get('last_name'), data.get('patronymic'), data['salt'],
+                data.get('iterations', 100000), data['hashed_password'],
+                json.dumps(name_index) if name_index is not None else None, data.get('names'))
+
+    def __init__(self, path: str = 'journal.db', teachers_storage=None):
+        """teachers_storage - другое хранилище, из которого берутся преподаватели
+        (например, общий teachers_data.json для нескольких баз групп)."""
+        self.path = path
+        self.teachers_storage = teachers_storage
+        self.teachers_path = teachers_storage.teachers_path if teachers_storage is not None else path
+        self.log_path = path + '.log'  # Не используется: изменения сразу пишутся в базу
+        self.lock_path = path + '.lock'
+        # Преподаватели в той же базе блокируются отдельно от журнала
+        self.teachers_lock_path = (teachers_storage.teachers_lock_path if teachers_storage is not None
+                                   else path + '.teachers.lock')
+        self._connection = None
+
+    @property
+    def connection(self):
+        """Открывает базу и создает схему при первом обращении."""
+        if self._connection is None:
+            import sqlite3
+
+            self._connection = sqlite3.connect(self.path)
+            self._connection.executescript(self.SCHEMA)
+            # Базы, созданные до появления слепого индекса имен и общего токена имени
+            for table in ('students', 'teachers'):
+                columns = {row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")}
+                for column in ('name_index', 'names'):
+                    if column not in columns:
+                        try:
+                            self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+                        except sqlite3.OperationalError:
+                            pass  # Столбец успел добавить другой процесс
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    # --- Снимок целиком (загрузка, перенос между хранилищами, compact) ---
+
+    def _user_record(self, row, name_index: str = None, names: str = None) -> dict:
+        if names is not None:
+            data = {'names': names, **dict(zip(self._USER_FIELDS[3:], row[4:7]))}
+        else:
+            data = dict(zip(self._USER_FIELDS, row[1:7]))
+        record = {'login': row[0], 'data': data}
+        if name_index is not None:
+            record['data']['name_index'] = json.loads(name_index)
+        return record
+
+    def iter_snapshot(self):
+        db = self.connection
+        meta = db.execute("SELECT key, value FROM meta").fetchall()
+        if not meta:
+            # Схема только что создана: журнал в базу еще не записывался
+            raise FileNotFoundError(f"Журнал в базе {self.path} еще не создан")
+        for key, value in meta:
+            yield key, json.loads(value)
+        for row in db.execute("SELECT login, first_name, last_name, patronymic, salt, iterations, "
+                              "hashed_password, serial_number, name_index, names FROM students ORDER BY rowid"):
+            record = self._user_record(row, row[8], row[9])
+            record['serial_number'] = row[7]
+            yield 'students', record
+        for subject_id, name, final_grades in db.execute("SELECT id, name, final_grades FROM subjects ORDER BY id").fetchall():
+            pairs = {}
+            for pair_id, date, topic, weight in db.execute(
+                    "SELECT id, date, topic, weight FROM pairs WHERE subject_id = ? ORDER BY id", (subject_id,)):
+                pairs[pair_id] = {'date': date, 'topic': topic, 'grades': {}, 'absentees': []}
+                if weight != 1:
+                    pairs[pair_id]['weight'] = weight
+            for pair_id, login, grade in db.execute(
+                    "SELECT g.pair_id, g.login, g.grade FROM grades g JOIN pairs p ON p.id = g.pair_id "
+                    "WHERE p.subject_id = ? ORDER BY g.rowid", (subject_id,)):
+                pairs[pair_id]['grades'][login] = grade
+            for pair_id, login in db.execute(
+                    "SELECT a.pair_id, a.login FROM absences a JOIN pairs p ON p.id = a.pair_id "
+                    "WHERE p.subject_id = ? ORDER BY a.rowid", (subject_id,)):
+                pairs[pair_id]['absentees'].append(login)
+            yield 'subjects', {'name': name, 'pairs': list(pairs.values()), 'final_grades': json.loads(final_grades)}
+
+    def write_snapshot(self, header: dict, students, subjects):
+        # Предметы частично загруженного журнала читаются из этой же базы,
+        # поэтому снимок собирается целиком до очистки таблиц
+        students, subjects = list(students), list(subjects)
+        db = self.connection
+        with db:
+            for table in ('meta', 'students', 'grades', 'absences', 'pairs', 'subjects'):
+                db.execute(f"DELETE FROM {table}")
+            db.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                           [(key, json.dumps(value, ensure_ascii=False)) for key, value in header.items()])
+            for record in students:
+                self._insert_student(record)
+            for subject in subjects:
+                db.execute("INSERT INTO subjects (name, final_grades) VALUES (?, ?)",
+                           (subject['name'], json.dumps(subject['final_grades'], ensure_ascii=False)))
+                for pair in subject['pairs']:
+                    self._insert_pair(subject['name'], pair)
+
+    def load_teachers(self) -> list:
+        if self.teachers_storage is not None:
+            return self.teachers_storage.load_teachers()
+        return [self._user_record(row, row[7], row[8]) for row in self.connection.execute(
+            "SELECT login, first_name, last_name, patronymic, salt, iterations, hashed_password, name_index, names "
+            "FROM teachers ORDER BY rowid")]
+
+    def save_teachers(self, records: list):
+        if self.teachers_storage is not None:
+            self.teachers_storage.save_teachers(records)
+            return
+        db = self.connection
+        with db:
+            db.execute("DELETE FROM teachers")
+            db.executemany(
+                "INSERT INTO teachers (login, first_name, last_name, patronymic, salt, iterations, hashed_password, "
+                "name_index, names) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r['login'], *self._user_values(r['data'])) for r in records])
+
+    def rewrite_users(self, table: str, convert, chunk_size: int):
+        """Преобразует записи пользователей таблицы (students или teachers) на месте.
+
+        Строки читаются частями по chunk_size, преобразуются convert (как в _rotate_journal)
+        и записываются обратно: одна транзакция UPDATE на часть. Файл базы не подменяется,
+        поэтому соединения других процессов продолжают работать с ней. Возвращает
+        итератор по числу уже обработанных записей (после каждой части).
+        """
+        db = self.connection
+        last_rowid, done = 0, 0
+        while True:
+            rows = db.execute(
+                f"SELECT rowid, login, first_name, last_name, patronymic, salt, iterations, hashed_password, "
+                f"name_index, names FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, chunk_size)).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            records = convert([self._user_record(row[1:], row[8], row[9]) for row in rows])
+            with db:
+                db.executemany(
+                    f"UPDATE {table} SET first_name = ?, last_name = ?, patronymic = ?, salt = ?, iterations = ?, "
+                    "hashed_password = ?, name_index = ?, names = ? WHERE login = ?",
+                    [(*self._user_values(r['data']), r['login']) for r in records])
+            done += len(rows)
+            yield done
+
+    # --- Построчная запись изменений ---
+
+    def _insert_student(self, record: dict):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO students (login, first_name, last_name, patronymic, salt, iterations, "
+            "hashed_password, name_index, names, serial_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (record['login'], *self._user_values(record['data']), record.get('serial_number')))
+
+    def _insert_pair(self, subject_name: str, pair: dict):
+        db = self.connection
+        cursor = db.execute(
+            "INSERT INTO pairs (subject_id, date, topic, weight) "
+            "SELECT id, ?, ?, ? FROM subjects WHERE name = ?",
+            (pair['date'], pair['topic'], pair.get('weight', 1), subject_name))
+        pair_id = cursor.lastrowid
+        db.executemany("INSERT OR REPLACE INTO grades (pair_id, login, grade) VALUES (?, ?, ?)",
+                       [(pair_id, login, grade) for login, grade in pair.get('grades', {}).items()])
+        db.executemany("INSERT OR IGNORE INTO absences (pair_id, login) VALUES (?, ?)",
+                       [(pair_id, login) for login in pair.get('absentees', [])])
+
+    def apply_records(self, records: list, journal):
+        """Записывает изменения журнала одной транзакцией, по строке на изменение."""
+        db = self.connection
+        with db:
+            for record in records:
+                op = record['op']
+                if op == 'add_student':
+                    self._insert_student(record)
+                elif op == 'remove_student':
+                    db.execute("DELETE FROM students WHERE login = ?", (record['login'],))
+                    db.execute("DELETE FROM grades WHERE login = ?", (record['login'],))
+                    db.execute("DELETE FROM absences WHERE login = ?", (record['login'],))
+                    db.executemany("UPDATE subjects SET final_grades = ? WHERE name = ?", [
+                        (json.dumps(subject.final_grades, ensure_ascii=False), subject.name)
+                        for subject in journal.subjects
+                    ])
+                elif op == 'add_subject':
+                    db.execute("INSERT INTO subjects (name) VALUES (?)", (record['name'],))
+                elif op == 'add_pair':
+                    self._insert_pair(record['subject'], record['pair'])
+                elif op == 'set_grade':
+                    db.execute(f"INSERT OR REPLACE INTO grades (pair_id, login, grade) VALUES ({self._PAIR_ID}, ?, ?)",
+                               (record['subject'], record['date'], record['login'], record['grade']))
+                elif op == 'mark_absent':
+                    db.execute(f"INSERT OR IGNORE INTO absences (pair_id, login) VALUES ({self._PAIR_ID}, ?)",
+                               (record['subject'], record['date'], record['login']))
+                elif op == 'calculate_final_grades':
+                    final_grades = journal.get_subject(record['subject']).final_grades
+                    db.execute("UPDATE subjects SET final_grades = ? WHERE name = ?",
+                               (json.dumps(final_grades, ensure_ascii=False), record['subject']))
+                else:
+                    raise ValueError(f"Неизвестная операция в журнале изменений: {op}")
+            if records:
+                db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               [('group', json.dumps(journal.group, ensure_ascii=False)),
+                                ('course', json.dumps(journal.course, ensure_ascii=False)),
+                                ('log_seq', str(records[-1]['seq']))])
+
+    # --- Запросы по индексам ---
+
+    def query_grades(self, login: str) -> dict:
+        """Последняя по дате оценка студента по каждому предмету (как Journal.show_grades)."""
+        rows = self.connection.execute(
+            "SELECT s.name, EXISTS (SELECT 1 FROM pairs WHERE subject_id = s.id), "
+            "(SELECT g.grade FROM grades g JOIN pairs p ON p.id = g.pair_id "
+            " WHERE g.login = ? AND p.subject_id = s.id ORDER BY p.date DESC, p.id DESC LIMIT 1) "
+            "FROM subjects s ORDER BY s.id", (login,))
+        return {
+            name: "Нет пар" if not has_pairs else (grade if grade is not None else "Нет оценки")
+            for name, has_pairs, grade in rows
+        }
+
+    def query_schedule(self, start: datetime = None, end: datetime = None, limit: int = None) -> dict:
+        """Расписание по предметам в порядке дат (как Journal.show_schedule)."""
+        db = self.connection
+        schedule = {name: [] for name, in db.execute("SELECT name FROM subjects ORDER BY id")}
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("p.date >= ?")
+            params.append(start.isoformat())
+        if end is not None:
+            conditions.append("p.date < ?")
+            params.append(end.isoformat())
+        query = ("SELECT s.name, p.date, p.topic FROM pairs p JOIN subjects s ON s.id = p.subject_id"
+                 + (" WHERE " + " AND ".join(conditions) if conditions else "")
+                 + " ORDER BY p.date, p.id")
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        for name, date, topic in db.execute(query, params):
+            schedule[name].append({'date': date, 'topic': topic})
+        if start is not None or end is not None or limit is not None:
+            schedule = {name: pairs for name, pairs in schedule.items() if pairs}
+        return schedule
+
+
+class ShardIndex:
+    """Каталог журналов групп: отдельный файл (шард) на каждую пару (группа, курс).
+
+    Файл index.json в каталоге сопоставляет группу и курс с файлом шарда.
+    Преподаватели общие для всех групп и хранятся, как и раньше, в teachers_data.json.
+    """
+
+    EXTENSIONS = {'json': '.json', 'binary': '.bin', 'sqlite': '.db'}
+
+    def __init__(self, directory: str = 'journals'):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.json')
+
+    def shards(self) -> list:
+        """Возвращает записи индекса: [{'group', 'course', 'path', 'format'}]."""
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)['shards']
+        except FileNotFoundError:
+            return []
+
+    @classmethod
+    def shard_format(cls, shard: dict) -> str:
+        """Формат шарда; в индексах прежних версий он определяется по расширению файла."""
+        return shard.get('format') or next(k for k, ext in cls.EXTENSIONS.items() if shard['path'].endswith(ext))
+
+    def _find(self, shards: list, group, course):
+        """Запись индекса для группы и курса или None.
+
+        Индексы прежних версий могли хранить по шарду на каждый формат:
+        тогда берется шард, файл которого существует.
+        """
+        matches = [s for s in shards if s['group'] == group and s['course'] == course]
+        for shard in matches:
+            if os.path.exists(os.path.join(self.directory, shard['path'])):
+                return shard
+        return matches[0] if matches else None
+
+    def shard(self, group, course):
+        """Запись индекса для группы и курса или None, если журнала группы еще нет."""
+        return self._find(self.shards(), group, course)
+
+    def _new_name(self, shards: list, group, course, kind: str) -> str:
+        base = ''.join(c if c.isalnum() or c in '-_' else '_' for c in f"{group}_{course}")
+        taken = {shard['path'] for shard in shards}
+        name, n = base + self.EXTENSIONS[kind], 1
+        while name in taken or os.path.exists(os.path.join(self.directory, name)):
+            n += 1  # Разные группы с одинаковым именем файла после очистки
+            name = f"{base}_{n}{self.EXTENSIONS[kind]}"
+        return name
+
+    def _register(self, shards: list, group, course, kind: str, name: str):
+        """Записывает в индекс единственный шард группы (вызывается под блокировкой индекса)."""
+        shards = [s for s in shards if not (s['group'] == group and s['course'] == course)]
+        shards.append({'group': group, 'course': course, 'path': name, 'format': kind})
+        _write_json_atomic(self.index_path, {'shards': shards})
+        return shards[-1]
+
+    def open_shard(self, shard: dict):
+        """Возвращает хранилище для записи индекса в ее формате."""
+        path = os.path.join(self.directory, shard['path'])
+        kind = self.shard_format(shard)
+        if kind == 'json':
+            return JsonStorage(path, 'teachers_data.json')
+        if kind == 'binary':
+            return BinaryStorage(path, teachers_storage=JsonStorage())
+        return SqliteStorage(path, teachers_storage=JsonStorage())
+
+    def storage_for(self, group, course, kind: str = None):
+        """Возвращает хранилище шарда группы.
+
+        У группы один шард: kind=None означает формат, в котором она уже хранится
+        (для новой группы - json). Если группа хранится в другом формате, чем kind,
+        вызывается ValueError - журнал нужно перенести методом convert.
+        Новый шард заполняется из общего journal_data.json, если тот относится
+        к этой же группе и курсу.
+        """
+        shard = self.shard(group, course)
+        if shard is None:
+            os.makedirs(self.directory, exist_ok=True)
+            with file_lock(self.index_path + '.lock'):
+                # Индекс перечитывается под блокировкой: его мог дополнить другой процесс
+                shards = self.shards()
+                shard = self._find(shards, group, course)
+                if shard is None:
+                    kind = kind or 'json'
+                    shard = self._register(shards, group, course, kind, self._new_name(shards, group, course, kind))
+
+        registered = self.shard_format(shard)
+        if kind is not None and kind != registered:
+            raise ValueError(f"Журнал группы {group}, курса {course} хранится в формате {registered}, "
+                             f"а не {kind}; перенесите его командой convert --to {kind}")
+        storage = self.open_shard(shard)
+        if not os.path.exists(_storage_path(storage)) and self._legacy_matches(group, course):
+            convert_storage(JsonStorage(), storage)
+        return storage
+
+    def convert(self, group, course, kind: str):
+        """Переносит шард группы в формат kind и регистрирует в индексе новый файл.
+
+        Прежний файл шарда остается на диске, но из индекса исключается.
+        """
+        source = self.storage_for(group, course)
+        if isinstance(source, STORAGES[kind]):
+            return source
+        with file_lock(self.index_path + '.lock'):
+            shards = self.shards()
+            name = self._new_name(shards, group, course, kind)
+            target = self.open_shard({'path': name, 'format': kind})
+            convert_storage(source, target)
+            self._register(shards, group, course, kind, name)
+        return target
+
+    @staticmethod
+    def _legacy_matches(group, course) -> bool:
+        """Проверяет, что общий journal_data.json принадлежит указанной группе и курсу."""
+        header = {}
+        try:
+            with open('journal_data.json', 'r') as f:
+                for key, value in _iter_json_object(f):
+                    if key in ('group', 'course'):
+                        header[key] = value
+                    if len(header) == 2 or key == 'students':
+                        break
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return header.get('group') == group and header.get('course') == course
+
+
 class Journal:
     """Класс для управления журналом (список студентов, преподавателей, предметов)."""
 
-    def __init__(self, group=None, course=None):
-        """Инициализирует журнал, загружает данные."""
+    # Размер журнала изменений (в байтах), после которого он сворачивается в снимок
+    WAL_COMPACT_THRESHOLD = 1024 * 1024
+    # Строк массового импорта, которые шифруются, хешируются и сохраняются за один раз
+    IMPORT_CHUNK_SIZE = 500
+
+    def __init__(self, group=None, course=None, use_wal=False, compact_grades=False, only_subjects=None,
+                 storage=None, name_index=False, record_encryption=False, name_cache_size=None):
+        """Инициализирует журнал, загружает данные.
+
+        При use_wal=True каждое изменение дописывается одной строкой в журнал
+        изменений (journal_data.json.log) вместо полной перезаписи journal_data.json.
+        При compact_grades=True оценки предметов хранятся в компактном GradeStore.
+        only_subjects - названия предметов, которые нужно загрузить; остальные
+        подгружаются по требованию (get_subject) и сохраняются без изменений.
+        storage - хранилище (JsonStorage по умолчанию, BinaryStorage или SqliteStorage).
+        При name_index=True ведется слепой индекс имен (метки HMAC рядом с шифротекстом),
+        и find_students/find_teachers ищут по меткам, не расшифровывая всех.
+        При record_encryption=True имена новых студентов и преподавателей шифруются
+        одним токеном на запись; прежние записи читаются как есть (см. migrate_names).
+        name_cache_size - размер кеша расшифрованных имен; по умолчанию он растет
+        под всех загруженных студентов и преподавателей.
+
+        С одним журналом могут одновременно работать несколько процессов: сохранение
+        идет под блокировкой файла, а изменения, сделанные другим процессом после
+        загрузки, объединяются со своими (см. _rebase).
+        """
         self.students = []
         self.teachers = []
         self.subjects = []
@@ -199,81 +1990,516 @@ class Journal:
         self.group = group  # Группа
         self.course = course  # Курс
 
+        self.storage = storage if storage is not None else JsonStorage()
+        self.use_wal = use_wal
+        self.compact_grades = compact_grades
+        # None - загружены все предметы; иначе журнал загружен частично
+        self.only_subjects = set(only_subjects) if only_subjects is not None else None
+        self._pending = []  # Изменения, еще не записанные на диск
+        self._log_seq = 0  # Номер последнего изменения, учтенного в данных
+        self._batch_depth = 0  # Вложенность batch(): внутри пакета сохранение откладывается
+        self._lock_depth = 0  # Вложенность _locked(): блокировка файла берется один раз
+        self.password_verifier = PasswordVerifier()
+        self.name_index = name_index
+        self.record_encryption = record_encryption
+        if name_cache_size is not None:
+            Person.name_cache.resize(name_cache_size)
+
+        # Индексы для поиска за O(1); синхронизируются со списками выше
+        self._students_by_login = {}
+        self._teachers_by_login = {}
+        self._subjects_by_name = {}
+        self.schedule = ScheduleIndex()  # Пары всех загруженных предметов по дате
+        self.student_names = NameIndex()  # Слепой индекс имен (при name_index=True)
+        self.teacher_names = NameIndex()
+
         self._load_teachers_data()  # Загрузка преподавателей из файла
-        self._load_data() #Загружаем студентов
+        # Снимок и журнал изменений читаются под блокировкой: иначе можно застать
+        # строку, которую другой процесс еще дописывает, или снимок без его журнала
+        with self._locked():
+            self._adopt_legacy_log()
+            self._reload() #Загружаем студентов
+
+    def _reload(self):
+        """Загружает снимок и воспроизводит журнал изменений (вызывается под блокировкой).
+
+        Метки слепого индекса, вычисленные для студентов, сохраненных без них,
+        сразу записываются снимком: иначе в режиме журнала изменений они не попали
+        бы на диск и имена расшифровывались бы заново при каждой загрузке.
+        """
+        self._load_data()
+        missing = self._rebuild_indexes()
+        self._replay_log()
+        if missing:
+            self.compact()
+
+    def _rebuild_indexes(self) -> int:
+        """Перестраивает индексы по логину, названию предмета, дате пары и имени после загрузки данных.
+
+        Возвращает число студентов, метки имени которых пришлось вычислить (см. _reload).
+        """
+        self._students_by_login = {s.login: s for s in self.students}
+        self._teachers_by_login = {t.login: t for t in self.teachers}
+        self._subjects_by_name = {s.name: s for s in self.subjects}
+        self.schedule.rebuild(self.subjects)
+        self._fit_name_cache()
+        missing = 0
+        if self.name_index:
+            # Новые метки студентов сохраняет _reload, преподавателей - сохраняются сразу
+            missing = self.student_names.rebuild(self.students)
+            if self.teacher_names.rebuild(self.teachers):
+                self._save_teachers_data()
+        return missing
+
+    def _fit_name_cache(self):
+        """Растит кеш имен под всех загруженных людей (до трех токенов на человека)."""
+        Person.name_cache.fit(len(NAME_FIELDS) * (len(self.students) + len(self.teachers)))
+
+    def get_student(self, login: str):
+        """Возвращает студента по логину или None."""
+        return self._students_by_login.get(login)
+
+    def get_teacher(self, login: str):
+        """Возвращает преподавателя по логину или None."""
+        return self._teachers_by_login.get(login)
+
+    def get_subject(self, name: str):
+        """Возвращает предмет по названию или None.
+
+        В частично загруженном журнале незагруженный предмет подгружается из файла.
+        """
+        subject = self._subjects_by_name.get(name)
+        if subject is None and self.only_subjects is not None and name not in self.only_subjects:
+            self.load_subjects([name])
+            subject = self._subjects_by_name.get(name)
+        return subject
+
+    def load_subjects(self, names=None):
+        """Подгружает предметы из файла журнала в частично загруженный журнал (names=None - все)."""
+        if self.only_subjects is None:
+            return
+        if names is not None:
+            names = set(names) - self.only_subjects
+            if not names:
+                return
+            self.only_subjects |= names
+        try:
+            for key, value in self.storage.iter_snapshot():
+                if key == 'subjects' and (names is None or value['name'] in names) \
+                        and value['name'] not in self._subjects_by_name:
+                    subject = Subject.from_dict(value, compact=self.compact_grades)
+                    self.subjects.append(subject)
+                    self._subjects_by_name[subject.name] = subject
+                    for pair in subject.pairs:
+                        self.schedule.add(subject.name, pair)
+        except FileNotFoundError:
+            pass
+        if names is None:
+            self.only_subjects = None  # Журнал загружен целиком
 
 
     def _load_teachers_data(self):
-        """Загружает данные преподавателей из файла JSON."""
+        """Загружает данные преподавателей из хранилища."""
+        try:
+            data = self.storage.load_teachers()
+
+            # Записи восстанавливаются как есть: без PBKDF2 и без расшифровки имен
+            self.teachers = [Teacher.from_record(t['login'], t['data']) for t in data]
+
+
+        except (FileNotFoundError, json.JSONDecodeError, StorageFormatError):
+            # Если файл не найден или поврежден, создаем пустой список
+            self.teachers = []
+            print(f"Файл {self.storage.teachers_path} не найден или поврежден. Начинаем с пустого списка преподавателей.")
+        except KeyError as e:
+            print(f"Ошибка при чтении данных преподавателя: Отсутствует ключ {e}. Возможно, структура файла teachers_data.json устарела.")
+        except Exception as e:
+            print(f"Неожиданная ошибка при загрузке преподавателей: {e}")
+
+    def _save_teachers_data(self):
+        """Сохраняет данные преподавателей в хранилище.
+
+        Преподаватели, которых за это время зарегистрировали другие процессы,
+        добавляются к своим, а не затираются.
+        """
         try:
-            with open('teachers_data.json', 'r') as f:
-                data = json.load(f)
+            with file_lock(self.storage.teachers_lock_path):
+                try:
+                    on_disk = self.storage.load_teachers()
+                except (FileNotFoundError, json.JSONDecodeError, StorageFormatError):
+                    on_disk = []
+                for record in on_disk:
+                    if record['login'] not in self._teachers_by_login:
+                        teacher = Teacher.from_record(record['login'], record['data'])
+                        self.teachers.append(teacher)
+                        self._teachers_by_login[teacher.login] = teacher
+                        if self.name_index:
+                            self.teacher_names.add(teacher)
+                self.storage.save_teachers([t.to_record() for t in self.teachers])
+        except IOError as e:
+            print(f"Ошибка при сохранении данных преподавателей в файл: {e}")
+        except TypeError as e:
+            print(f"Ошибка при сериализации данных преподавателей в JSON: {e}")
+        except Exception as e:
+            print(f"Неожиданная ошибка при сохранении преподавателей: {e}")
+
+
+    def _auto_save(func):
+        """Декоратор для автоматического сохранения изменений после выполнения функции."""
+        def wrapper(self, *args, **kwargs):
+            result = func(self, *args, **kwargs)
+            if not self._batch_depth:
+                self._commit()
+            return result
+
+        return wrapper
+
+    @contextmanager
+    def batch(self):
+        """Пакет изменений: сохранение один раз при выходе, откат при исключении.
+
+        Пример:
+            with journal.batch():
+                for login, grade in rows:
+                    journal.add_grade(login, 'Математика', grade)
+        """
+        if self._batch_depth:
+            # Вложенный пакет входит в состав внешнего
+            yield self
+            return
+
+        # Независимая копия состояния для отката (живые объекты будут изменяться)
+        snapshot = json.loads(json.dumps(self._serialize()))
+        # Набор загруженных предметов тоже откатывается: подгруженный внутри пакета
+        # предмет иначе считался бы загруженным, хотя в восстановленном списке его нет
+        only_subjects = set(self.only_subjects) if self.only_subjects is not None else None
+        self._batch_depth = 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth = 0
+            self._pending = []
+            self._apply_snapshot(snapshot)
+            self.only_subjects = only_subjects
+            self._rebuild_indexes()
+            raise
+        self._batch_depth = 0
+        self._commit()
+
+    def _mutate(self, record: dict):
+        """Применяет изменение к журналу и ставит его в очередь на сохранение."""
+        self._apply_record(record)
+        self._log_seq += 1
+        record['seq'] = self._log_seq
+        self._pending.append(record)
+
+    def _apply_record(self, record: dict):
+        """Применяет одну запись изменения (и при работе, и при воспроизведении журнала изменений)."""
+        op = record['op']
+        if op == 'add_student':
+            student = Student.from_record(record['login'], record['data'], record.get('serial_number'))
+            self.students.append(student)
+            self._students_by_login[student.login] = student
+            self._fit_name_cache()
+            if self.name_index:
+                self.student_names.add(student)
+        elif op == 'remove_student':
+            student = self._students_by_login.pop(record['login'], None)
+            if student is not None:
+                self.students.remove(student)
+                if self.name_index:
+                    self.student_names.remove(student)
+            # Оценки удаляются из всех предметов, в том числе еще не загруженных
+            self.load_subjects()
+            for subject in self.subjects:
+                subject.remove_student(record['login'])
+        elif op == 'add_subject':
+            subject = Subject(record['name'], compact=self.compact_grades)
+            self.subjects.append(subject)
+            self._subjects_by_name[subject.name] = subject
+        elif op == 'add_pair':
+            pair = Pair.from_dict(record['pair'])
+            self.get_subject(record['subject']).add_pair(pair)
+            self.schedule.add(record['subject'], pair)
+        elif op == 'set_grade':
+            subject = self.get_subject(record['subject'])
+            subject.find_pair(datetime.fromisoformat(record['date'])).set_grade(record['login'], record['grade'])
+        elif op == 'mark_absent':
+            subject = self.get_subject(record['subject'])
+            subject.find_pair(datetime.fromisoformat(record['date'])).mark_absent(record['login'])
+        elif op == 'calculate_final_grades':
+            self.get_subject(record['subject']).calculate_final_grades()
+        else:
+            raise ValueError(f"Неизвестная операция в журнале изменений: {op}")
+
+    def _commit(self):
+        """Записывает накопленные изменения: в журнал изменений или полным снимком.
+
+        Запись идет под блокировкой файла журнала; если другой процесс успел
+        сохранить свою версию, изменения сначала переносятся поверх нее (_rebase).
+        """
+        if not self._pending:
+            return
+        with self._locked():
+            self._rebase()
+            if not self._pending:  # Все изменения оказались конфликтующими
+                return
+            if self.storage.record_level:
+                import sqlite3  # Уже загружен хранилищем SqliteStorage
+
+                try:
+                    self.storage.apply_records(self._pending, self)
+                except sqlite3.Error as e:
+                    print(f"Ошибка при записи изменений в базу данных: {e}")
+                self._pending = []
+                return
+            if not self.use_wal or not os.path.exists(self.storage.data_path):
+                # Первое сохранение нового журнала пишет снимок: без него каждая
+                # загрузка начиналась бы с ошибки об отсутствующем файле
+                self.compact()
+                return
+            self._append_log(self._pending)
+            self._pending = []
+            if os.path.getsize(self.storage.log_path) >= self.WAL_COMPACT_THRESHOLD:
+                self.compact()
+
+    @contextmanager
+    def _locked(self):
+        """Блокировка файла журнала между процессами; повторный вход в том же журнале не ждет."""
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        with file_lock(self.storage.lock_path):
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+
+    def _disk_version(self) -> int:
+        """Версия журнала на диске - номер последнего записанного изменения.
+
+        Берется из log_seq снимка и из последней строки журнала изменений.
+        """
+        version = 0
+        snapshot = self.storage.iter_snapshot()
+        try:
+            for key, value in snapshot:  # Заголовок снимка идет перед студентами и предметами
+                if key == 'log_seq':
+                    version = value
+                    break
+                if key in ('students', 'subjects'):
+                    break
+        except (FileNotFoundError, json.JSONDecodeError, StorageFormatError):
+            pass
+        finally:
+            snapshot.close()
+
+        try:
+            with open(self.storage.log_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 65536))
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            lines = []
+        for line in reversed(lines):
+            try:
+                return max(version, json.loads(line)['seq'])
+            except (ValueError, KeyError):
+                continue  # Недописанная строка или обрезанное начало окна
+        return version
+
+    def _conflict(self, record: dict):
+        """Проверяет, можно ли применить изменение к перечитанному журналу. Возвращает описание конфликта или None."""
+        op = record['op']
+        if op == 'add_student' and record['login'] in self._students_by_login:
+            return f"студент {record['login']} уже добавлен"
+        if op == 'add_subject' and self.get_subject(record['name']) is not None:
+            return f"предмет {record['name']} уже добавлен"
+        if op in ('add_pair', 'set_grade', 'mark_absent', 'calculate_final_grades'):
+            subject = self.get_subject(record['subject'])
+            if subject is None:
+                return f"предмет {record['subject']} не найден"
+            if op == 'add_pair' and subject.find_pair(datetime.fromisoformat(record['pair']['date'])) is not None:
+                return f"пара {record['pair']['date']} по {record['subject']} уже добавлена"
+        if op in ('set_grade', 'mark_absent') and record['login'] not in self._students_by_login:
+            return f"студент {record['login']} удален"
+        return None
+
+    def _rebase(self) -> bool:
+        """Переносит несохраненные изменения поверх версии журнала на диске (вызывается под блокировкой).
+
+        Если с момента загрузки другой процесс сохранил журнал, данные перечитываются,
+        а свои изменения применяются к ним заново: правки разных пар и студентов
+        объединяются. Оценку, которую изменили оба, получает последний сохранивший;
+        изменения, которые уже невозможны (студент удален, логин занят), отбрасываются.
+        Возвращает True, если журнал был перечитан.
+        """
+        pending = self._pending
+        if self._disk_version() == self._log_seq - len(pending):
+            return False
+
+        user = self.current_user
+        self._pending = []
+        self._reload()
+        for record in pending:
+            conflict = self._conflict(record)
+            if conflict is not None:
+                print(f"Изменение не сохранено, журнал изменен другим пользователем: {conflict}.")
+                continue
+            if record['op'] == 'add_student':
+                record['serial_number'] = len(self.students) + 1
+            self._mutate(record)
+        if isinstance(user, Student):
+            self.current_user = self.get_student(user.login)
+        return True
+
+    def refresh(self) -> bool:
+        """Подхватывает изменения, сохраненные другими процессами. Возвращает True, если данные обновились."""
+        with self._locked():
+            return self._rebase()
+
+    def _append_log(self, records: list):
+        """Дописывает изменения в журнал изменений (по одной компактной строке на изменение)."""
+        encode, write = _section('json.encode'), _section('io.write')
+        with encode:
+            lines = ''.join(
+                json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records
+            )
+        try:
+            with write:
+                with open(self.storage.log_path, 'a') as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+        except IOError as e:
+            print(f"Ошибка при записи в журнал изменений: {e}")
+            return
+        encode.record()
+        write.record()
+
+    def _adopt_legacy_log(self):
+        """Переименовывает журнал изменений JSON-журнала, записанный под прежним именем."""
+        legacy_path = getattr(self.storage, 'legacy_log_path', None)
+        if legacy_path and os.path.exists(legacy_path) and not os.path.exists(self.storage.log_path):
+            with self._locked():
+                if os.path.exists(legacy_path) and not os.path.exists(self.storage.log_path):
+                    os.replace(legacy_path, self.storage.log_path)
+
+    def _replay_log(self):
+        """Воспроизводит изменения из журнала изменений, не вошедшие в снимок (вызывается под блокировкой).
+
+        Поврежденные строки в середине журнала пропускаются. Отрезается только
+        недописанная последняя строка: под блокировкой ее уже никто не дописывает.
+        """
+        if self.storage.record_level:
+            return  # Построчное хранилище (SQLite) пишет изменения сразу, журнала изменений у него нет
+        try:
+            f = open(self.storage.log_path, 'r+')
+        except FileNotFoundError:
+            return
 
-            self.teachers = []
-            for t in data:
-                teacher = Teacher(
-                    first_name=EncryptionHelper.decrypt(t['data']['first_name'].encode()),
-                    last_name=EncryptionHelper.decrypt(t['data']['last_name'].encode()),
-                    patronymic=EncryptionHelper.decrypt(t['data']['patronymic'].encode()),
-                    login=t['login'],
-                    password='temp',  # Пароль не сохраняется в открытом виде
-                    salt=bytes.fromhex(t['data']['salt']),
-                    hashed_password=bytes.fromhex(t['data']['hashed_password'])
-                )
-                self.teachers.append(teacher)
+        with f:
+            number = 0
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                number += 1
+                try:
+                    record = json.loads(line)
+                    seq = record['seq']
+                except (ValueError, KeyError, TypeError):
+                    if not line.endswith('\n'):
+                        # Недописанная последняя строка после сбоя: отрезаем ее, чтобы новые записи не склеились с ней
+                        print("Журнал изменений обрывается на недописанной записи, она пропущена.")
+                        f.seek(offset)
+                        f.truncate()
+                        break
+                    print(f"Поврежденная строка {number} журнала изменений пропущена.")
+                    continue
+                if not line.endswith('\n'):
+                    f.write('\n')
+                if seq <= self._log_seq:
+                    continue  # Уже учтено в снимке
+                try:
+                    self._apply_record(record)
+                except (KeyError, AttributeError, ValueError) as e:
+                    print(f"Ошибка при воспроизведении журнала изменений: {e}")
+                    continue
+                self._log_seq = seq
 
+    def compact(self):
+        """Сворачивает журнал изменений в снимок journal_data.json и очищает его."""
+        self._pending = []
+        with self._locked():
+            if self._save_data() and os.path.exists(self.storage.log_path):
+                os.remove(self.storage.log_path)
 
-        except (FileNotFoundError, json.JSONDecodeError):
-            # Если файл не найден или поврежден, создаем пустой список
-            self.teachers = []
-            print("Файл teachers_data.json не найден или поврежден. Начинаем с пустого списка преподавателей.")
-        except KeyError as e:
-            print(f"Ошибка при чтении данных преподавателя: Отсутствует ключ {e}. Возможно, структура файла teachers_data.json устарела.")
-        except Exception as e:
-            print(f"Неожиданная ошибка при загрузке преподавателей: {e}")
+    def logout(self):
+        """Завершает сеанс пользователя и стирает расшифрованные имена из памяти."""
+        self.current_user = None
+        Person.name_cache.clear()
 
-    def _save_teachers_data(self):
-        """Сохраняет данные преподавателей в файл JSON."""
-        data = [
-            {
-                'login': t.login,
-                'data': {
-                    'first_name': t._first_name.decode(),
-                    'last_name': t._last_name.decode(),
-                    'patronymic': t._patronymic.decode(),
-                    'salt': t._salt.hex(),
-                    'hashed_password': t._hashed_password.hex()
-                }
-            } for t in self.teachers
+    def roster(self) -> list:
+        """Возвращает список группы (порядковый номер, логин, ФИО) с пакетной расшифровкой имен."""
+        return [
+            {'serial_number': s.serial_number, 'login': s.login, 'full_name': full_name}
+            for s, full_name in zip(self.students, Person.full_names(self.students))
         ]
 
-        try:
-            with open('teachers_data.json', 'w') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-        except IOError as e:
-            print(f"Ошибка при сохранении данных преподавателей в файл: {e}")
-        except TypeError as e:
-            print(f"Ошибка при сериализации данных преподавателей в JSON: {e}")
-        except Exception as e:
-            print(f"Неожиданная ошибка при сохранении преподавателей: {e}")
+    def find_students(self, last_name: str = None, first_name: str = None, patronymic: str = None,
+                      prefix: bool = False) -> list:
+        """Студенты, у которых заданные поля имени совпадают (при prefix=True - начинаются с заданных).
 
+        Сравнение без учета регистра, ё = е. Со слепым индексом (name_index=True)
+        расшифровываются только найденные кандидаты, без него - все студенты.
+        """
+        found = self._find_people(self.students, self._students_by_login, self.student_names,
+                                  {'last_name': last_name, 'first_name': first_name, 'patronymic': patronymic}, prefix)
+        return sorted(found, key=lambda s: (s.serial_number is None, s.serial_number or 0))
 
-    def _auto_save(func):
-        """Декоратор для автоматического сохранения данных после выполнения функции."""
-        def wrapper(self, *args, **kwargs):
-            result = func(self, *args, **kwargs)
-            self._save_data()
-            return result
+    def find_teachers(self, last_name: str = None, first_name: str = None, patronymic: str = None,
+                      prefix: bool = False) -> list:
+        """Преподаватели с заданными полями имени (см. find_students)."""
+        found = self._find_people(self.teachers, self._teachers_by_login, self.teacher_names,
+                                  {'last_name': last_name, 'first_name': first_name, 'patronymic': patronymic}, prefix)
+        return sorted(found, key=lambda t: t.login)
 
-        return wrapper
+    def _find_people(self, people: list, by_login: dict, names: NameIndex, criteria: dict, prefix: bool) -> list:
+        criteria = {field: normalize_name(value) for field, value in criteria.items() if value is not None}
+        if prefix:
+            criteria = {field: value for field, value in criteria.items() if value}  # Пустой префикс - любое значение
+        if not criteria:
+            return list(people)
+        if self.name_index:
+            logins = None
+            for field, value in criteria.items():
+                candidates = names.lookup(field, value, prefix)
+                logins = candidates if logins is None else logins & candidates
+            people = [by_login[login] for login in logins if login in by_login]
+
+        def matches(person) -> bool:
+            for field, value in criteria.items():
+                actual = normalize_name(getattr(person, field))
+                if not (actual.startswith(value) if prefix else actual == value):
+                    return False
+            return True
+
+        return [person for person in people if matches(person)]
 
     def user_exists(self, login: str) -> bool:
         """Проверяет, существует ли пользователь с указанным логином."""
-        return any(u.login == login for u in self.students + self.teachers)
+        return login in self._students_by_login or login in self._teachers_by_login
 
     def teacher_exists(self, login: str) -> bool:
         """Проверяет, существует ли преподаватель с указанным логином."""
-        return any(t.login == login for t in self.teachers)
+        return login in self._teachers_by_login
 
 
     def register_teacher(self, user_data: dict):
@@ -281,27 +2507,64 @@ class Journal:
       if self.teacher_exists(user_data['login']):
           raise ValueError("Преподаватель с таким логином уже существует!")
 
-      new_teacher = Teacher(**user_data)
+      new_teacher = Teacher(**user_data, record_encryption=self.record_encryption)
+      if self.name_index:
+          new_teacher.build_name_index(user_data)
+          self.teacher_names.add(new_teacher)
       self.teachers.append(new_teacher)
+      self._teachers_by_login[new_teacher.login] = new_teacher
       self._save_teachers_data()
 
+    def _login_candidates(self, login: str) -> list:
+        """Возвращает пользователей с данным логином (студент проверяется первым)."""
+        return [u for u in (self._students_by_login.get(login), self._teachers_by_login.get(login)) if u is not None]
+
+    def authenticate(self, login: str, password: str):
+        """Проверяет логин и пароль, не меняя текущего пользователя. Возвращает пользователя или None."""
+        for user in self._login_candidates(login):
+            if user.check_password(password):
+                return user
+        return None
+
+    async def authenticate_async(self, login: str, password: str):
+        """Асинхронная authenticate: PBKDF2 выполняется в пуле, одновременные входы хешируются параллельно."""
+        for user in self._login_candidates(login):
+            if await self.password_verifier.verify_async(user, password):
+                return user
+        return None
+
     def login(self, login: str, password: str) -> bool:
         """Выполняет вход пользователя."""
-        for user in self.students + self.teachers:
-            if user.login == login and user.check_password(password):
-                self.current_user = user
-                return True
-        return False
+        user = self.authenticate(login, password)
+        if user is None:
+            return False
+        self.current_user = user
+        return True
+
+    async def login_async(self, login: str, password: str) -> bool:
+        """Асинхронный вход пользователя (см. authenticate_async)."""
+        user = await self.authenticate_async(login, password)
+        if user is None:
+            return False
+        self.current_user = user
+        return True
 
     @_auto_save
     def add_student(self, student_data: dict):
         """Добавляет студента в журнал (только для преподавателей)."""
         if isinstance(self.current_user, Teacher):
+            if student_data['login'] in self._students_by_login:
+                print("Студент с таким логином уже существует!")
+                return
+
             # Определяем порядковый номер
             serial_number = len(self.students) + 1
 
-            new_student = Student(**student_data, serial_number=serial_number) # Передаем порядковый номер
-            self.students.append(new_student)
+            new_student = Student(**student_data, serial_number=serial_number,  # Передаем порядковый номер
+                                  record_encryption=self.record_encryption)
+            if self.name_index:
+                new_student.build_name_index(student_data)  # Метки по открытым значениям, без расшифровки
+            self._mutate({'op': 'add_student', **new_student.to_record()})
             print(f"Студент {new_student.full_name} успешно добавлен! Порядковый номер: {serial_number}")
         else:
             print("Только преподаватели могут добавлять студентов.")
@@ -310,9 +2573,9 @@ class Journal:
     def remove_student(self, student_login: str):
         """Удаляет студента из журнала (только для преподавателей)."""
         if isinstance(self.current_user, Teacher):
-            student_to_remove = next((s for s in self.students if s.login == student_login), None)
+            student_to_remove = self._students_by_login.get(student_login)
             if student_to_remove:
-                self.students.remove(student_to_remove)
+                self._mutate({'op': 'remove_student', 'login': student_login})
                 print(f"Студент {student_to_remove.full_name} успешно удален!")
             else:
                 print("Студент с таким логином не найден!")
@@ -323,8 +2586,11 @@ class Journal:
     def add_subject(self, subject_name: str):
         """Добавляет предмет в журнал (только для преподавателей)."""
         if isinstance(self.current_user, Teacher):
-            new_subject = Subject(subject_name)
-            self.subjects.append(new_subject)
+            if self.get_subject(subject_name) is not None:
+                print(f"Предмет {subject_name} уже существует!")
+                return
+
+            self._mutate({'op': 'add_subject', 'name': subject_name})
             print(f"Предмет {subject_name} добавлен!")
         else:
             print("Только преподаватели могут добавлять предметы.")
@@ -333,12 +2599,16 @@ class Journal:
     def add_pair(self, subject_name: str, pair_data: dict):
         """Добавляет пару (занятие) к предмету (только для преподавателей)."""
         if isinstance(self.current_user, Teacher):
-            subject = next((s for s in self.subjects if s.name == subject_name), None)
+            subject = self.get_subject(subject_name)
             if subject:
                 try:
                     pair_data['date'] = datetime.fromisoformat(pair_data['date']) # Преобразование строки в datetime
+                    # Пара определяется предметом и датой (как в записях изменений и при слиянии в _rebase)
+                    if subject.find_pair(pair_data['date']) is not None:
+                        print(f"Пара {pair_data['date'].isoformat()} по {subject_name} уже есть!")
+                        return
                     new_pair = Pair(**pair_data)
-                    subject.add_pair(new_pair)
+                    self._mutate({'op': 'add_pair', 'subject': subject_name, 'pair': new_pair.to_dict()})
                     print(f"Пара по {subject_name} добавлена!")
                 except ValueError as e:
                     print(f"Ошибка при добавлении пары: Неверный формат даты.  Ожидается ISO формат (YYYY-MM-DDTHH:MM:SS).")
@@ -352,14 +2622,22 @@ class Journal:
     def add_grade(self, student_login: str, subject_name: str, grade: int):
         """Добавляет оценку студенту по предмету (только для преподавателей)."""
         if isinstance(self.current_user, Teacher):
-            student = next((s for s in self.students if s.login == student_login), None)
-            subject = next((s for s in self.subjects if s.name == subject_name), None)
+            student = self._students_by_login.get(student_login)
+            subject = self.get_subject(subject_name)
 
-            if student and subject:
-                # Найдем последнюю пару по предмету
+            if not valid_grade(grade):
+                print(f"Ошибка: оценка должна быть целым числом от {MIN_GRADE} до {MAX_GRADE}!")
+            elif student and subject:
+                # Найдем последнюю по дате пару (как в show_grades)
                 if subject.pairs:  # Если в предмете есть хоть какие-то пары
-                   last_pair = subject.pairs[-1]
-                   last_pair.set_grade(student_login, grade)
+                   last_pair = subject.latest_pair()
+                   self._mutate({
+                       'op': 'set_grade',
+                       'subject': subject_name,
+                       'date': last_pair.date.isoformat(),
+                       'login': student_login,
+                       'grade': grade
+                   })
                    print(f"Оценка {grade} выставлена {student.full_name} по {subject_name}")
 
                 else:
@@ -369,126 +2647,362 @@ class Journal:
         else:
             print("Только преподаватели могут выставлять оценки.")
 
-    def show_grades(self):
-        """Показывает оценки текущего студента по всем предметам."""
+    @_auto_save
+    def mark_absent(self, student_login: str, subject_name: str):
+        """Отмечает отсутствие студента на последней по дате паре по предмету (только для преподавателей)."""
+        if isinstance(self.current_user, Teacher):
+            student = self._students_by_login.get(student_login)
+            subject = self.get_subject(subject_name)
+            if student and subject and subject.pairs:
+                self._mutate({
+                    'op': 'mark_absent',
+                    'subject': subject_name,
+                    'date': subject.latest_pair().date.isoformat(),
+                    'login': student_login
+                })
+                print(f"{student.full_name} отмечен(а) отсутствующим(ей) по {subject_name}")
+            else:
+                print("Ошибка: студент, предмет или пара не найдены!")
+        else:
+            print("Только преподаватели могут отмечать отсутствующих.")
+
+    @_auto_save
+    def calculate_final_grades(self, subject_name: str) -> dict:
+        """Рассчитывает и сохраняет итоговые оценки по предмету (только для преподавателей)."""
+        if isinstance(self.current_user, Teacher):
+            if self.get_subject(subject_name) is not None:
+                self._mutate({'op': 'calculate_final_grades', 'subject': subject_name})
+                return self._subjects_by_name[subject_name].final_grades
+            print(f"Предмет {subject_name} не найден!")
+        else:
+            print("Только преподаватели могут рассчитывать итоговые оценки.")
+        return {}
+
+    # --- Массовый импорт и выгрузка (см. import_csv и export_csv) ---
+
+    def _commit_chunk(self):
+        """Сохраняет часть импорта (внутри batch() - вместе со всем пакетом)."""
+        if not self._batch_depth:
+            self._commit()
+
+    def import_students(self, rows) -> int:
+        """Добавляет студентов из строк {'login', 'last_name', 'first_name', 'patronymic', 'password'}
+        (только для преподавателей). Возвращает число добавленных.
+
+        Строки обрабатываются частями: пароли части хешируются параллельно в пуле,
+        имена шифруются одним пакетом, а часть сохраняется на диск один раз.
+        """
+        if not isinstance(self.current_user, Teacher):
+            print("Только преподаватели могут добавлять студентов.")
+            return 0
+        added = 0
+        for chunk in _chunked(rows, self.IMPORT_CHUNK_SIZE):
+            new_rows, logins = [], set()
+            for row in chunk:
+                login = row.get('login')
+                if not login or not row.get('password'):
+                    print(f"Строка без логина или пароля пропущена: {row}")
+                elif login in self._students_by_login or login in logins:
+                    print(f"Студент с логином {login} уже существует, строка пропущена.")
+                else:
+                    logins.add(login)
+                    new_rows.append(row)
+            if not new_rows:
+                continue
+
+            credentials = self.password_verifier.hash_many([row['password'] for row in new_rows])
+            if self.record_encryption:
+                names = EncryptionHelper.encrypt_many(
+                    [Person._join_names(row[field] or '' for field in NAME_FIELDS) for row in new_rows]
+                )
+                names = [{'names': token.decode()} for token in names]
+            else:
+                names = EncryptionHelper.encrypt_many([row[field] or '' for row in new_rows for field in NAME_FIELDS])
+                names = [
+                    {field: token.decode() for field, token in zip(NAME_FIELDS, names[3 * i:3 * i + 3])}
+                    for i in range(len(new_rows))
+                ]
+            for row, names_data, (salt, hashed_password) in zip(new_rows, names, credentials):
+                data = {
+                    **names_data,
+                    'salt': salt.hex(),
+                    'iterations': PBKDF2_ITERATIONS,
+                    'hashed_password': hashed_password.hex()
+                }
+                if self.name_index:
+                    data['name_index'] = name_tags(row)
+                self._mutate({
+                    'op': 'add_student',
+                    'login': row['login'],
+                    'data': data,
+                    'serial_number': len(self.students) + 1
+                })
+            self._commit_chunk()
+            added += len(new_rows)
+        return added
+
+    def import_pairs(self, rows) -> int:
+        """Добавляет пары из строк {'subject', 'date', 'topic', 'weight' (необязательно)}
+        (только для преподавателей). Недостающие предметы создаются. Возвращает число добавленных пар."""
+        if not isinstance(self.current_user, Teacher):
+            print("Только преподаватели могут добавлять пары.")
+            return 0
+        added = 0
+        for chunk in _chunked(rows, self.IMPORT_CHUNK_SIZE):
+            for row in chunk:
+                try:
+                    pair = Pair(datetime.fromisoformat(row['date']), row['topic'] or '',
+                                weight=float(row.get('weight') or 1))
+                except (KeyError, TypeError, ValueError):
+                    print(f"Строка с неверной датой или весом пропущена: {row}")
+                    continue
+                subject_name = row.get('subject')
+                if not subject_name:
+                    print(f"Строка без предмета пропущена: {row}")
+                    continue
+                subject = self.get_subject(subject_name)
+                if subject is None:
+                    self._mutate({'op': 'add_subject', 'name': subject_name})
+                elif subject.find_pair(pair.date) is not None:
+                    print(f"Пара {row['date']} по {subject_name} уже есть, строка пропущена.")
+                    continue
+                self._mutate({'op': 'add_pair', 'subject': subject_name, 'pair': pair.to_dict()})
+                added += 1
+            self._commit_chunk()
+        return added
+
+    def import_grades(self, rows) -> int:
+        """Выставляет оценки из строк {'subject', 'date', 'login', 'grade'} (только для преподавателей).
+
+        Пара определяется предметом и датой. Возвращает число выставленных оценок.
+        """
+        if not isinstance(self.current_user, Teacher):
+            print("Только преподаватели могут выставлять оценки.")
+            return 0
+        added = 0
+        for chunk in _chunked(rows, self.IMPORT_CHUNK_SIZE):
+            for row in chunk:
+                try:
+                    date = datetime.fromisoformat(row['date'])
+                    grade = int(row['grade'])
+                except (KeyError, TypeError, ValueError):
+                    print(f"Строка с неверной датой или оценкой пропущена: {row}")
+                    continue
+                if not valid_grade(grade):
+                    print(f"Оценка вне диапазона {MIN_GRADE}-{MAX_GRADE}, строка пропущена: {row}")
+                    continue
+                subject = self.get_subject(row.get('subject') or '')
+                pair = subject.find_pair(date) if subject is not None else None
+                if pair is None or row.get('login') not in self._students_by_login:
+                    print(f"Студент, предмет или пара не найдены, строка пропущена: {row}")
+                    continue
+                self._mutate({'op': 'set_grade', 'subject': subject.name, 'date': pair.date.isoformat(),
+                              'login': row['login'], 'grade': grade})
+                added += 1
+            self._commit_chunk()
+        return added
+
+    def export_students(self):
+        """Выдает строки студентов {'serial_number', 'login', 'last_name', 'first_name', 'patronymic'}
+        (только для преподавателей). Имена расшифровываются пакетами, без заполнения кеша имен."""
+        if not isinstance(self.current_user, Teacher):
+            print("Только преподаватели могут выгружать список студентов.")
+            return
+        for chunk in _chunked(self.students, self.IMPORT_CHUNK_SIZE):
+            for student, (first_name, last_name, patronymic) in zip(chunk, Person.names_many(chunk, cache=False)):
+                yield {
+                    'serial_number': student.serial_number,
+                    'login': student.login,
+                    'last_name': last_name,
+                    'first_name': first_name,
+                    'patronymic': patronymic
+                }
+
+    def export_pairs(self):
+        """Выдает строки пар {'subject', 'date', 'topic', 'weight'} (только для преподавателей)."""
+        if not isinstance(self.current_user, Teacher):
+            print("Только преподаватели могут выгружать пары.")
+            return
+        for subject in self.subjects:
+            for pair in subject.pairs:
+                yield {'subject': subject.name, 'date': pair.date.isoformat(), 'topic': pair.topic, 'weight': pair.weight}
+
+    def export_grades(self):
+        """Выдает строки оценок {'subject', 'date', 'login', 'grade'} (только для преподавателей)."""
+        if not isinstance(self.current_user, Teacher):
+            print("Только преподаватели могут выгружать оценки.")
+            return
+        for subject in self.subjects:
+            for pair in subject.pairs:
+                date = pair.date.isoformat()
+                for login, grade in pair.grades.items():
+                    yield {'subject': subject.name, 'date': date, 'login': login, 'grade': grade}
+
+    def show_grades(self, detailed: bool = False):
+        """Показывает оценки текущего студента по всем предметам.
+
+        По умолчанию - последняя по дате оценка по каждому предмету. При detailed=True
+        для каждого предмета возвращаются последняя оценка, средние, пропуски, итоговая
+        оценка и вся история оценок.
+        """
         if isinstance(self.current_user, Student):
+            login = self.current_user.login
+            if not detailed and hasattr(self.storage, 'query_grades') and not self._pending:
+                return self.storage.query_grades(login)
             grades = {}
             for subject in self.subjects:
-                # Ищем последнюю пару по предмету и берем из нее оценку
-                if subject.pairs:
-                   last_pair = subject.pairs[-1]
-                   grades[subject.name] = last_pair.grades.get(self.current_user.login, "Нет оценки") # оценка студента или "Нет оценки"
-                else:
-                    grades[subject.name] = "Нет пар" # Если нет пар по предмету
+                history = subject.grade_history(login)
+                if not detailed:
+                    if history:
+                        grades[subject.name] = history[-1][1]
+                    else:
+                        grades[subject.name] = "Нет оценки" if subject.pairs else "Нет пар"
+                    continue
+                aggregate = subject.aggregates.get(login)
+                grades[subject.name] = {
+                    'latest': history[-1][1] if history else None,
+                    'average': aggregate.average if aggregate else None,
+                    'weighted_average': aggregate.weighted_average if aggregate else None,
+                    'absences': aggregate.absences if aggregate else 0,
+                    'final': subject.final_grades.get(login),
+                    'history': [
+                        {'date': pair.date.isoformat(), 'topic': pair.topic, 'grade': grade}
+                        for pair, grade in history
+                    ]
+                }
             return grades
         else:
             print("Только студенты могут просматривать свои оценки.")
             return {}
 
-    def show_schedule(self):
-        """Показывает расписание студента."""
+    def show_schedule(self, start: datetime = None, end: datetime = None, limit: int = None):
+        """Показывает расписание студента: пары каждого предмета в порядке дат.
+
+        start и end ограничивают период (start <= дата < end), limit - число первых пар
+        периода; при ограничениях предметы без пар в выборке не показываются.
+        """
         if isinstance(self.current_user, Student):
-            schedule = {}
-            for subject in self.subjects:
-                schedule[subject.name] = []
-                for pair in subject.pairs:
-                    schedule[subject.name].append({
-                        'date': pair.date.isoformat(),
-                        'topic': pair.topic
-                    })
+            if hasattr(self.storage, 'query_schedule') and not self._pending:
+                return self.storage.query_schedule(start, end, limit)
+            schedule = {subject.name: [] for subject in self.subjects}
+            for name, date, topic in self.schedule.between(start, end, limit):
+                schedule[name].append({'date': date, 'topic': topic})
+            if start is not None or end is not None or limit is not None:
+                schedule = {name: pairs for name, pairs in schedule.items() if pairs}
             return schedule
         else:
             print("Только студенты могут просматривать расписание.")
             return {}
 
-    def _save_data(self):
-        """Сохраняет данные журнала в файл JSON."""
-        data = {
+    def week_schedule(self, now: datetime = None):
+        """Расписание на текущую неделю (с понедельника по воскресенье)."""
+        now = now or datetime.now()
+        monday = datetime(now.year, now.month, now.day) - timedelta(days=now.weekday())
+        return self.show_schedule(start=monday, end=monday + timedelta(days=7))
+
+    def next_pairs(self, count: int = 5, now: datetime = None):
+        """Ближайшие count пар начиная с текущего момента."""
+        return self.show_schedule(start=now or datetime.now(), limit=count)
+
+    def _serialize(self) -> dict:
+        """Возвращает полный снимок журнала в виде, пригодном для JSON."""
+        return {
             'group': self.group,
             'course': self.course,
-            'students': [
-                {
-                    'login': s.login,
-                    'data': {
-                        'first_name': s._first_name.decode(),
-                        'last_name': s._last_name.decode(),
-                        'patronymic': s._patronymic.decode(),
-                        'salt': s._salt.hex(),
-                        'hashed_password': s._hashed_password.hex()
-                    },
-                    'serial_number': s.serial_number
-                } for s in self.students
-            ],
-            'subjects': [
-                {
-                    'name': s.name,
-                    'pairs': [
-                        {
-                            'date': p.date.isoformat(),
-                            'topic': p.topic,
-                            'grades': p.grades,
-                            'absentees': p.absentees
-                        } for p in s.pairs
-                    ],
-                    'final_grades': s.final_grades
-                } for s in self.subjects
-            ]
+            'log_seq': self._log_seq,
+            'students': [s.to_record() for s in self.students],
+            'subjects': [s.to_dict() for s in self.subjects]
         }
 
+    def _save_data(self) -> bool:
+        """Сохраняет снимок журнала в хранилище. Возвращает True при успехе."""
+        self._pending = []
+        header = {'group': self.group, 'course': self.course, 'log_seq': self._log_seq}
+        if self.only_subjects is None:
+            subjects = (s.to_dict() for s in self.subjects)
+        else:
+            subjects = self._merged_subjects()
         try:
-            with open('journal_data.json', 'w') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            self.storage.write_snapshot(header, [s.to_record() for s in self.students], subjects)
+            return True
         except IOError as e:
             print(f"Ошибка при сохранении данных в файл: {e}")
         except TypeError as e:
             print(f"Ошибка при сериализации данных в JSON: {e}")
+        return False
 
 
-    def _load_data(self):
-        """Загружает данные журнала из файла JSON."""
+    def _merged_subjects(self):
+        """Предметы частично загруженного журнала для сохранения.
+
+        Незагруженные предметы потоково переносятся из старого снимка без разбора
+        в объекты, загруженные - записываются из памяти на свои места.
+        """
+        loaded = {s.name: s for s in self.subjects}
         try:
-            with open('journal_data.json', 'r') as f:
-                data = json.load(f)
+            for key, value in self.storage.iter_snapshot():
+                if key == 'subjects':
+                    subject = loaded.pop(value['name'], None)
+                    yield subject.to_dict() if subject is not None else value
+        except FileNotFoundError:
+            pass
+        for subject in loaded.values():  # Новые предметы
+            yield subject.to_dict()
 
-            self.group = data.get('group')
-            self.course = data.get('course')
+    def _apply_snapshot(self, data: dict):
+        """Заменяет состояние журнала данными снимка (индексы нужно перестроить отдельно)."""
+        self.group = data.get('group')
+        self.course = data.get('course')
+        self._log_seq = data.get('log_seq', 0)
 
-            # Загрузка студентов
-            self.students = []
-            for s in data['students']:
-                student = Student(
-                    first_name=EncryptionHelper.decrypt(s['data']['first_name'].encode()),
-                    last_name=EncryptionHelper.decrypt(s['data']['last_name'].encode()),
-                    patronymic=EncryptionHelper.decrypt(s['data']['patronymic'].encode()),
-                    login=s['login'],
-                    password='temp',  # Пароль не сохраняется в открытом виде
-                    serial_number=s.get('serial_number')
+        # Загрузка студентов
+        self.students = [
+            Student.from_record(s['login'], s['data'], s.get('serial_number'))
+            for s in data['students']
+        ]
 
-                )
-                student._salt = bytes.fromhex(s['data']['salt'])
-                student._hashed_password = bytes.fromhex(s['data']['hashed_password'])
-                self.students.append(student)
+        # Загрузка предметов
+        self.subjects = [Subject.from_dict(subj, compact=self.compact_grades) for subj in data['subjects']]
 
-            # Загрузка предметов
+    def _load_data(self):
+        """Загружает данные журнала из хранилища."""
+        try:
+            # Снимок разбирается потоково: объекты создаются по мере чтения,
+            # дерево JSON целиком в памяти не держится
+            snapshot = self.storage.iter_snapshot()
+            key, value = next(snapshot, (None, None))  # Здесь открывается файл (FileNotFoundError)
+            self.group = self.course = None
+            self._log_seq = 0
+            self.students = []
             self.subjects = []
-            for subj in data['subjects']:
-                subject = Subject(subj['name'])
-                for p in subj['pairs']:
-                    pair = Pair(
-                        date=datetime.fromisoformat(p['date']),
-                        topic=p['topic'],
-                        grades=p.get('grades', {}),  # Используем .get(), чтобы избежать KeyError, если нет ключа
-                        absentees=p.get('absentees', []) # Аналогично для absentees
-                    )
-                    subject.pairs.append(pair)
-                subject.final_grades = subj['final_grades']
-                self.subjects.append(subject)
-
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            print(f"Ошибка при загрузке данных из файла: {e}")
+            seen = set()
+            while key is not None:
+                seen.add(key)
+                if key == 'students':
+                    self.students.append(Student.from_record(value['login'], value['data'], value.get('serial_number')))
+                elif key == 'subjects':
+                    if self.only_subjects is None or value['name'] in self.only_subjects:
+                        self.subjects.append(Subject.from_dict(value, compact=self.compact_grades))
+                elif key == 'group':
+                    self.group = value
+                elif key == 'course':
+                    self.course = value
+                elif key == 'log_seq':
+                    self._log_seq = value
+                key, value = next(snapshot, (None, None))
+            # Пустые списки выдаются потоковым чтением без единой пары (ключ, элемент),
+            # поэтому обязательность ключей проверяется только для файлов без заголовка
+            for key in ('students', 'subjects'):
+                if key not in seen and not seen & {'group', 'log_seq'}:
+                    raise KeyError(key)
+
+        except (FileNotFoundError, json.JSONDecodeError, StorageFormatError) as e:
+            # Снимка еще нет, но изменения есть в журнале изменений - данные целы
+            if not (isinstance(e, FileNotFoundError) and os.path.exists(self.storage.log_path)):
+                print(f"Ошибка при загрузке данных из файла: {e}")
             # Если файл не найден или поврежден, создаем пустые списки
+            # (преподаватели загружаются из своего файла и не сбрасываются)
             self.students = []
-            self.teachers = []
             self.subjects = []
         except KeyError as e:
             print(f"Ошибка при чтении данных: Отсутствует ключ {e}.  Возможно, структура файла journal_data.json устарела.")
@@ -496,13 +3010,593 @@ class Journal:
             print(f"Ошибка при преобразовании данных: {e}")
 
 
+def convert_storage(source, target):
+    """Переносит журнал и преподавателей из одного хранилища в другое (например, JSON <-> двоичный формат).
+
+    Перед переносом воспроизводится журнал изменений источника. Сам источник не
+    меняется: у каждого формата свой журнал изменений, и без него источник
+    потерял бы изменения, еще не свернутые в его снимок.
+    """
+    journal = Journal(storage=source)
+    journal.storage = target
+    journal._save_teachers_data()
+    journal.compact()
+    return journal
+
+
+# Столбцы CSV: при импорте (необязательные помечены в import_csv) и при выгрузке
+CSV_IMPORT_COLUMNS = {
+    'students': ('login', 'last_name', 'first_name', 'patronymic', 'password'),
+    'pairs': ('subject', 'date', 'topic', 'weight'),
+    'grades': ('subject', 'date', 'login', 'grade'),
+}
+CSV_EXPORT_COLUMNS = {
+    'students': ('serial_number', 'login', 'last_name', 'first_name', 'patronymic'),
+    'pairs': ('subject', 'date', 'topic', 'weight'),
+    'grades': ('subject', 'date', 'login', 'grade'),
+}
+
+
+def import_csv(journal, kind: str, path: str) -> int:
+    """Потоково импортирует студентов, пары или оценки (kind) из CSV-файла с заголовком.
+
+    Файл читается построчно и обрабатывается частями (Journal.IMPORT_CHUNK_SIZE).
+    Возвращает число импортированных строк.
+    """
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = set(CSV_IMPORT_COLUMNS[kind]) - {'weight'} - set(reader.fieldnames or ())
+        if missing:
+            print(f"В файле {path} нет столбцов: {', '.join(sorted(missing))}")
+            return 0
+        return getattr(journal, f'import_{kind}')(reader)
+
+
+def export_csv(journal, kind: str, path: str) -> int:
+    """Потоково выгружает студентов, пары или оценки (kind) в CSV-файл. Возвращает число строк."""
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_EXPORT_COLUMNS[kind])
+        writer.writeheader()
+        for row in getattr(journal, f'export_{kind}')():
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+# --- Ротация ключа шифрования ---
+ROTATION_PROGRESS_SUFFIX = '.rotation'  # Рядом с файлом ключей: выполненные части прерванной ротации
+ROTATION_CHUNK_SIZE = 1000  # Записей, перешифровываемых одним параллельным пакетом
+
+
+def _name_fields(data: dict) -> tuple:
+    """Поля записи пользователя с зашифрованным именем: общий токен или три поля."""
+    return ('names',) if 'names' in data else NAME_FIELDS
+
+
+def _rotate_user_records(records: list) -> list:
+    """Перешифровывает имена в записях пользователей основным ключом (одним пакетом)."""
+    rotated = iter(EncryptionHelper.rotate_many(
+        [r['data'][f].encode() for r in records for f in _name_fields(r['data'])]
+    ))
+    for record in records:
+        for field in _name_fields(record['data']):
+            record['data'][field] = next(rotated).decode()
+    return records
+
+
+def _pack_user_records(records: list) -> list:
+    """Заменяет три токена имени в записях пользователей одним общим (одним пакетом)."""
+    todo = [r for r in records if 'names' not in r['data']]
+    values = EncryptionHelper.decrypt_many([r['data'][f].encode() for r in todo for f in NAME_FIELDS])
+    tokens = EncryptionHelper.encrypt_many([Person._join_names(values[3 * i:3 * i + 3]) for i in range(len(todo))])
+    for record, token in zip(todo, tokens):
+        data = record['data']
+        record['data'] = {'names': token.decode(), **{k: v for k, v in data.items() if k not in NAME_FIELDS}}
+    return records
+
+
+def _unpack_user_records(records: list) -> list:
+    """Обратно к _pack_user_records: общий токен имени заменяется тремя токенами полей."""
+    todo = [r for r in records if 'names' in r['data']]
+    values = EncryptionHelper.decrypt_many([r['data']['names'].encode() for r in todo])
+    tokens = EncryptionHelper.encrypt_many([value for text in values for value in json.loads(text)])
+    for i, record in enumerate(todo):
+        data = record['data']
+        names = {field: token.decode() for field, token in zip(NAME_FIELDS, tokens[3 * i:3 * i + 3])}
+        record['data'] = {**names, **{k: v for k, v in data.items() if k != 'names'}}
+    return records
+
+
+def _storage_path(storage) -> str:
+    return storage.path if isinstance(storage, SqliteStorage) else storage.data_path
+
+
+def _rotate_journal(storage, convert=_rotate_user_records):
+    """Потоково перешифровывает снимок и журнал изменений одного журнала.
+
+    convert - преобразование части записей пользователей (по умолчанию - перешифровка
+    основным ключом; migrate_names передает смену раскладки имени).
+    Студенты читаются из снимка частями, перешифровываются и сразу пишутся в новый
+    файл того же формата, который затем атомарно подменяет старый. Базу SQLite
+    подменять нельзя (записи открытых соединений ушли бы в старый файл), она
+    перешифровывается на месте. Пока идет проход, журнал заблокирован для записи
+    другими процессами.
+    """
+    path = _storage_path(storage)
+    if isinstance(storage, SqliteStorage):
+        _rotate_sqlite(storage, convert)
+        return
+    base, ext = os.path.splitext(path)
+    tmp_path = base + '.rotating' + ext
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)  # Остаток прерванного прохода
+    target = type(storage)(tmp_path, storage.teachers_path)  # Пишется только снимок, не преподаватели
+
+    with file_lock(storage.lock_path):
+        if os.path.exists(path):
+            snapshot = storage.iter_snapshot()
+            header, first = {}, []
+            for key, value in snapshot:
+                if key in ('students', 'subjects'):
+                    first.append((key, value))
+                    break
+                header[key] = value
+            rest = chain(first, snapshot)
+            subjects_head = []  # Первый предмет, на котором закончились студенты
+            done = 0
+
+            def student_records():
+                for key, value in rest:
+                    if key != 'students':
+                        subjects_head.append(value)
+                        return
+                    yield value
+
+            def students():
+                nonlocal done
+                for chunk in _chunked(student_records(), ROTATION_CHUNK_SIZE):
+                    yield from convert(chunk)
+                    done += len(chunk)
+                    print(f"  {path}: перешифровано студентов: {done}")
+
+            def subjects():
+                yield from subjects_head
+                for _, value in rest:
+                    yield value
+
+            target.write_snapshot(header, students(), subjects())
+            os.replace(tmp_path, path)
+
+        if os.path.exists(storage.log_path):
+            # В журнале изменений зашифрованы имена в записях add_student
+            log_tmp_path = storage.log_path + '.rotating'
+            with open(storage.log_path, 'r') as src, open(log_tmp_path, 'w') as dst:
+                for chunk in _chunked(src, ROTATION_CHUNK_SIZE):
+                    records = []
+                    for line in chunk:
+                        try:
+                            records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            print("Недописанная запись журнала изменений пропущена.")
+                    convert([r for r in records if r['op'] == 'add_student'])
+                    dst.write(''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records))
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(log_tmp_path, storage.log_path)
+
+
+def _rotate_sqlite(storage, convert=_rotate_user_records):
+    """Перешифровывает базу SQLite на месте частями (см. SqliteStorage.rewrite_users).
+
+    Прерванный проход оставляет часть записей в прежнем виде; convert обрабатывает
+    обе раскладки и оба ключа, поэтому проход достаточно запустить повторно.
+    """
+    path = storage.path
+    try:
+        with file_lock(storage.lock_path):
+            if not os.path.exists(path):
+                return
+            for done in storage.rewrite_users('students', convert, ROTATION_CHUNK_SIZE):
+                print(f"  {path}: перешифровано студентов: {done}")
+            # Преподаватели базы без общего файла хранятся в ней же
+            if storage.teachers_storage is None:
+                with file_lock(storage.teachers_lock_path):
+                    for _ in storage.rewrite_users('teachers', convert, ROTATION_CHUNK_SIZE):
+                        pass
+    finally:
+        storage.close()
+
+
+def _rotate_teachers(storage, convert=_rotate_user_records):
+    """Перешифровывает файл преподавателей (он небольшой и читается целиком)."""
+    with file_lock(storage.teachers_lock_path):
+        storage.save_teachers(convert(storage.load_teachers()))
+    print(f"  {storage.teachers_path}: преподаватели перешифрованы")
+
+
+def _rotation_targets(journals_dir: str, convert=_rotate_user_records) -> list:
+    """Файлы с зашифрованными именами: [(путь, функция перешифровки записей convert)].
+
+    Общие файлы всех форматов, журналы групп из индекса и файлы преподавателей.
+    """
+    storages = [JsonStorage(), BinaryStorage(), SqliteStorage()]
+    shards = ShardIndex(journals_dir)
+    for shard in shards.shards():
+        if os.path.exists(os.path.join(journals_dir, shard['path'])):
+            storages.append(shards.open_shard(shard))
+
+    targets, teachers = [], {}
+    for storage in storages:
+        path = _storage_path(storage)
+        if os.path.exists(path) or os.path.exists(storage.log_path):
+            targets.append((path, lambda storage=storage: _rotate_journal(storage, convert)))
+        # Преподаватели базы SQLite без общего файла переносятся вместе с базой
+        if not (isinstance(storage, SqliteStorage) and storage.teachers_storage is None):
+            teachers.setdefault(storage.teachers_path, storage)
+    for path, storage in teachers.items():
+        if os.path.exists(path):
+            targets.append((path, lambda storage=storage: _rotate_teachers(storage, convert)))
+    return targets
+
+
+def rotate_key(journals_dir: str = 'journals', drop_old_keys: bool = False):
+    """Вводит новый ключ шифрования и перешифровывает им все имена.
+
+    Новый ключ становится первым в файле ключей; прежние остаются для расшифровки,
+    поэтому данные читаются и во время прохода. Выполненные файлы отмечаются в
+    <файл ключей>.rotation: прерванная ротация при повторном запуске продолжается
+    без нового ключа. drop_old_keys=True удаляет прежние ключи после прохода.
+    Другие запущенные сеансы журнала следует перезапустить: они шифруют новые
+    записи ключом, который был основным при их запуске.
+    """
+    from cryptography.fernet import Fernet
+
+    global cipher
+    progress_path = KEY_FILE_PATH + ROTATION_PROGRESS_SUFFIX
+    try:
+        with open(progress_path, 'r') as f:
+            progress = json.load(f)
+        print(f"Продолжение прерванной ротации ключа (выполнено файлов: {len(progress['done'])}).")
+    except FileNotFoundError:
+        crypto_init()  # Создает файл ключа, если его еще нет
+        with open(KEY_FILE_PATH, 'rb') as f:
+            keys = f.read().split()
+        with open(KEY_FILE_PATH + '.tmp', 'wb') as f:
+            f.write(b'\n'.join([Fernet.generate_key()] + keys))
+        os.replace(KEY_FILE_PATH + '.tmp', KEY_FILE_PATH)
+        # Отметка о начале ротации: повторный запуск продолжит ее, не добавляя еще один ключ
+        progress = {'done': []}
+        _write_json_atomic(progress_path, progress)
+        print("Добавлен новый ключ шифрования.")
+    cipher = crypto_init()
+
+    for path, rotate in _rotation_targets(journals_dir):
+        if path in progress['done']:
+            print(f"{path}: уже перешифрован, пропускается")
+            continue
+        print(f"Перешифровка {path}...")
+        rotate()
+        progress['done'].append(path)
+        _write_json_atomic(progress_path, progress)
+
+    if drop_old_keys:
+        with open(KEY_FILE_PATH, 'rb') as f:
+            primary = f.read().split()[0]
+        with open(KEY_FILE_PATH + '.tmp', 'wb') as f:
+            f.write(primary)
+        os.replace(KEY_FILE_PATH + '.tmp', KEY_FILE_PATH)
+        cipher = crypto_init()
+        print("Прежние ключи удалены.")
+    os.remove(progress_path)
+    Person.name_cache.clear()
+    print("Ротация ключа завершена.")
+
+
+def migrate_names(journals_dir: str = 'journals', record_level: bool = True):
+    """Переводит сохраненные имена на один токен на запись (record_level=True) или обратно на токены по полям.
+
+    Проходит те же файлы, что и rotate_key, с той же потоковой атомарной заменой.
+    Записи, уже имеющие нужный вид, не меняются, поэтому прерванный перевод
+    достаточно запустить повторно. Журналы читают обе раскладки, так что
+    работающие сеансы перезапускать не обязательно.
+    """
+    convert = _pack_user_records if record_level else _unpack_user_records
+    for path, migrate in _rotation_targets(journals_dir, convert):
+        print(f"Перевод имен в {path}...")
+        migrate()
+    Person.name_cache.clear()
+    print("Перевод имен завершен.")
+
+
+# --- Режим сервера ---
+def parse_flag(value) -> bool:
+    """Значение флага из строки запроса, JSON или переменной окружения: 1/true/yes - включен."""
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+
+class JournalServer:
+    """Локальный HTTP/JSON-сервер поверх одного загруженного журнала.
+
+    Все пользователи работают с одним процессом, где журнал уже загружен и
+    проиндексирован; соединения переиспользуются (HTTP/1.1 keep-alive). После
+    входа клиент получает токен сеанса и передает его в заголовке
+    Authorization: Bearer <токен>.
+
+    Адреса (тело запроса и ответа - JSON; параметры GET-запросов - в строке запроса):
+        POST /login          {"login", "password"} -> {"token", "role", "full_name"}
+        POST /logout
+        POST /add_grade      {"login", "subject", "grade"}       (преподаватель)
+        POST /add_pair       {"subject", "date", "topic"}        (преподаватель)
+        GET  /show_grades    ?detailed=1                         (студент)
+        GET  /show_schedule                                      (студент)
+    """
+
+    SESSION_TTL = 8 * 60 * 60  # Сеанс без запросов истекает через 8 часов
+    KEEP_ALIVE_TIMEOUT = 15  # Секунды ожидания следующего запроса в соединении
+    MAX_BODY = 1024 * 1024
+    MAX_HEADERS = 100
+
+    def __init__(self, journal, host: str = '127.0.0.1', port: int = 8080):
+        self.journal = journal
+        self.host = host
+        self.port = port
+        self.sessions = {}  # токен -> [логин, роль, время последнего запроса]
+        self._executor = None  # Поток журнала: все вызовы журнала выполняются в нем по одному
+        # (метод, адрес) -> (класс пользователя или None для входа, обработчик)
+        self.routes = {
+            ('POST', '/login'): (None, self._login),
+            ('POST', '/logout'): (User, self._logout),
+            ('POST', '/add_grade'): (Teacher, self._add_grade),
+            ('POST', '/add_pair'): (Teacher, self._add_pair),
+            ('GET', '/show_grades'): (Student, self._show_grades),
+            ('GET', '/show_schedule'): (Student, self._show_schedule),
+        }
+
+    async def serve_forever(self):
+        import asyncio
+
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"Сервер журнала запущен на http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+
+    # --- HTTP ---
+
+    async def _handle_connection(self, reader, writer):
+        """Обслуживает запросы одного соединения, пока клиент держит его открытым."""
+        import asyncio
+
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except ValueError as e:
+                    self._write_response(writer, 400, {'error': str(e)}, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:  # Клиент закрыл соединение
+                    break
+                method, path, query, headers, body, keep_alive = request
+                status, payload = await self._dispatch(method, path, headers, body, query)
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """Читает один запрос: (метод, адрес, строка запроса, заголовки, тело, keep_alive) или None в конце соединения."""
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise ValueError("Некорректная строка запроса")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= self.MAX_HEADERS:
+                raise ValueError("Слишком много заголовков")
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise ValueError("Некорректный Content-Length")
+        if length < 0 or length > self.MAX_BODY:
+            raise ValueError("Слишком большое тело запроса")
+        body = await reader.readexactly(length) if length else b''
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+        path, _, query = target.partition('?')
+        return method.upper(), path, query, headers, body, keep_alive
+
+    @staticmethod
+    def _write_response(writer, status: int, payload: dict, keep_alive: bool):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+
+    async def _dispatch(self, method: str, path: str, headers: dict, body: bytes, query: str = ''):
+        """Находит обработчик, проверяет сеанс и роль. Возвращает (код ответа, JSON).
+
+        Параметры GET-запроса берутся из строки запроса, остальных - из JSON в теле.
+        """
+        route = self.routes.get((method, path))
+        if route is None:
+            if any(route_path == path for _, route_path in self.routes):
+                return 405, {'error': "Метод не поддерживается"}
+            return 404, {'error': "Неизвестный адрес"}
+        role, handler = route
+
+        if method == 'GET':
+            from urllib.parse import parse_qsl
+
+            data = dict(parse_qsl(query))
+        else:
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError:
+                return 400, {'error': "Тело запроса не является JSON"}
+            if not isinstance(data, dict):
+                return 400, {'error': "Ожидается JSON-объект"}
+
+        token, user = None, None
+        if role is not None:
+            token, user = self._session_user(headers)
+            if user is None:
+                return 401, {'error': "Требуется вход"}
+            if not isinstance(user, role):
+                return 403, {'error': "Действие недоступно для вашей роли"}
+        try:
+            return await handler(user, data, token)
+        except KeyError as e:
+            return 400, {'error': f"Не указано поле {e}"}
+        except (TypeError, ValueError, OverflowError) as e:
+            return 400, {'error': f"Некорректные данные: {e}"}
+        except Exception as e:
+            # Ошибка хранилища (например, sqlite3.Error) не должна обрывать соединение
+            print(f"Ошибка при обработке запроса {method} {path}: {e!r}")
+            return 500, {'error': "Внутренняя ошибка сервера"}
+
+    # --- Сеансы ---
+
+    def _session_user(self, headers: dict):
+        """Возвращает (токен, пользователь) по заголовку Authorization или (None, None)."""
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        session = self.sessions.get(token) if scheme.lower() == 'bearer' else None
+        if session is None:
+            return None, None
+        login, role, last_seen = session
+        now = time.monotonic()
+        if now - last_seen > self.SESSION_TTL:
+            del self.sessions[token]
+            return None, None
+        session[2] = now
+        # Пользователь берется из журнала заново: журнал мог быть перечитан (см. Journal.refresh)
+        user = self.journal.get_teacher(login) if role == 'teacher' else self.journal.get_student(login)
+        return token, user
+
+    async def _call(self, user, method, *args):
+        """Вызывает метод журнала от имени пользователя сеанса.
+
+        Возвращает (результат, изменился ли журнал, сообщения журнала). Перечитывание
+        журнала, запись на диск и перехват вывода выполняются в отдельном потоке журнала,
+        чтобы не останавливать цикл событий (входы, чтение запросов). Поток один, поэтому
+        вызовы идут по одному и запросы не перемешиваются на current_user и sys.stdout.
+        """
+        import asyncio
+
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+            # Соединение SQLite работает только в создавшем его потоке: журнал загружался
+            # в основном потоке, поэтому соединение закрывается и откроется уже в потоке журнала
+            if isinstance(self.journal.storage, SqliteStorage):
+                self.journal.storage.close()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call_sync, user, method, *args)
+
+    def _call_sync(self, user, method, *args):
+        journal = self.journal
+        journal.refresh()  # Изменения других процессов (консольных сеансов)
+        version = journal._log_seq
+        output = io.StringIO()
+        journal.current_user = user
+        try:
+            with redirect_stdout(output):
+                result = method(*args)
+        finally:
+            journal.current_user = None
+        return result, journal._log_seq != version, output.getvalue().strip()
+
+    # --- Обработчики ---
+
+    async def _login(self, user, data: dict, token):
+        if not isinstance(data['login'], str) or not isinstance(data['password'], str):
+            return 400, {'error': "Логин и пароль должны быть строками"}
+        user = await self.journal.authenticate_async(data['login'], data['password'])
+        if user is None:
+            return 401, {'error': "Неверный логин или пароль"}
+        token = secrets.token_urlsafe(32)
+        role = 'teacher' if isinstance(user, Teacher) else 'student'
+        self.sessions[token] = [user.login, role, time.monotonic()]
+        return 200, {'token': token, 'role': role, 'full_name': user.full_name}
+
+    async def _logout(self, user, data: dict, token):
+        self.sessions.pop(token, None)
+        return 200, {'ok': True}
+
+    async def _add_grade(self, user, data: dict, token):
+        # Оценка не приводится к int: true или 4.9 - ошибка клиента, а не оценка 1 или 4
+        if not valid_grade(data['grade']):
+            return 400, {'error': f"Оценка должна быть целым числом от {MIN_GRADE} до {MAX_GRADE}"}
+        _, changed, message = await self._call(user, self.journal.add_grade,
+                                               data['login'], data['subject'], data['grade'])
+        return (200 if changed else 400), {'ok': changed, 'message': message}
+
+    async def _add_pair(self, user, data: dict, token):
+        pair_data = {'date': data['date'], 'topic': data['topic']}
+        if 'weight' in data:
+            pair_data['weight'] = float(data['weight'])
+        _, changed, message = await self._call(user, self.journal.add_pair, data['subject'], pair_data)
+        return (200 if changed else 400), {'ok': changed, 'message': message}
+
+    async def _show_grades(self, user, data: dict, token):
+        grades, _, _ = await self._call(user, self.journal.show_grades, parse_flag(data.get('detailed', '')))
+        return 200, {'grades': grades}
+
+    async def _show_schedule(self, user, data: dict, token):
+        schedule, _, _ = await self._call(user, self.journal.show_schedule)
+        return 200, {'schedule': schedule}
+
+
 # --- Функции пользовательского интерфейса ---
-def main_menu():
+def _group_storage(journals_dir: str, group, course, storage_kind: str = None):
+    """Хранилище журнала группы или None, если группа хранится в другом формате."""
+    try:
+        return ShardIndex(journals_dir).storage_for(group, course, storage_kind)
+    except ValueError as e:
+        print(e)
+        return None
+
+
+def main_menu(storage_kind: str = None, journals_dir: str = 'journals', name_index: bool = False,
+              record_encryption: bool = False):
     """Главное меню приложения."""
     # Добавляем ввод информации о группе и курсе при создании журнала
     group = input("Введите номер группы: ")
     course = input("Введите номер курса: ")
-    journal = Journal(group=group, course=course)
+    # Загружается только журнал выбранной группы
+    storage = _group_storage(journals_dir, group, course, storage_kind)
+    if storage is None:
+        return
+    journal = Journal(group=group, course=course, use_wal=True, storage=storage, name_index=name_index,
+                      record_encryption=record_encryption)
 
     while True:
         print("\nГлавное меню:")
@@ -551,7 +3645,7 @@ def handle_login(journal):
         user_type = 'teacher' if isinstance(journal.current_user, Teacher) else 'student'
         if (role_choice == '1' and user_type != 'teacher') or (role_choice == '2' and user_type != 'student'):
             print("Несоответствие выбранной роли!")
-            journal.current_user = None  # Сбрасываем текущего пользователя
+            journal.logout()  # Сбрасываем текущего пользователя
             return
 
         print(f"Добро пожаловать, {journal.current_user.full_name}!")
@@ -617,7 +3711,8 @@ def teacher_menu(journal):
         print("5. Выставить оценку студенту")
         print("6. Вывести информацию о группе")
         print("7. Переключить предмет и пару")
-        print("8. Выйти")
+        print("8. Найти студента по фамилии")
+        print("9. Выйти")
         choice = input("Выберите действие: ")
 
         if choice == '1':
@@ -655,8 +3750,8 @@ def teacher_menu(journal):
             print(f"Группа: {journal.group}, Курс: {journal.course}")
 
             print("\nСписок студентов в группе:")
-            for student in journal.students:
-                print(student)
+            for entry in journal.roster():
+                print(f"Student(serial_number={entry['serial_number']}, full_name='{entry['full_name']}')")
 
             print("\nСписок предметов:")
             for subject in journal.subjects:
@@ -666,7 +3761,7 @@ def teacher_menu(journal):
 
             subject_name = input("Введите название предмета: ")
 
-            subject = next((s for s in journal.subjects if s.name == subject_name), None)
+            subject = journal.get_subject(subject_name)
 
             if not subject:
                 print("Предмет с таким названием не найден!")
@@ -695,18 +3790,43 @@ def teacher_menu(journal):
             selected_pair.display_pair_info()
 
         elif choice == '8':
+            last_name = input("Фамилия (или ее начало): ")
+            found = journal.find_students(last_name=last_name, prefix=True)
+            if not found:
+                print("Студенты не найдены.")
+            for student in found:
+                print(f"{student.serial_number}. {student.full_name} ({student.login})")
+        elif choice == '9':
+            journal.logout()
             break
         else:
             print("Некорректный выбор.")
 
+def print_schedule(schedule: dict):
+    """Выводит расписание, полученное из Journal.show_schedule."""
+    if schedule:
+        for subject, pairs in schedule.items():
+            print(f"\n{subject}:")
+            if pairs:
+                for pair in pairs:
+                    print(f"  - {pair['date']} : {pair['topic']}")
+            else:
+                print("  Нет занятий.")
+    else:
+        print("У вас нет расписания.")
+
+
 def student_menu(journal):
     """Меню студента."""
     while True:
         print("\nМеню студента:")
         print("1. Посмотреть оценки")
-        print("2. Посмотреть расписание")
-        print("3. Посмотреть информацию о группе")
-        print("4. Выйти")
+        print("2. История оценок и средний балл")
+        print("3. Посмотреть расписание")
+        print("4. Расписание на неделю")
+        print("5. Ближайшие пары")
+        print("6. Посмотреть информацию о группе")
+        print("7. Выйти")
         choice = input("Выберите действие: ")
 
         if choice == '1':
@@ -717,24 +3837,260 @@ def student_menu(journal):
             else:
                 print("У вас пока нет оценок.")
         elif choice == '2':
-            schedule = journal.show_schedule()
-            if schedule:
-                for subject, pairs in schedule.items():
-                    print(f"\n{subject}:")
-                    if pairs:
-                        for pair in pairs:
-                            print(f"  - {pair['date']} : {pair['topic']}")
-                    else:
-                        print("  Нет занятий.")
-            else:
-                print("У вас нет расписания.")
+            for subject, info in journal.show_grades(detailed=True).items():
+                print(f"\n{subject}:")
+                for entry in info['history']:
+                    print(f"  - {entry['date']} ({entry['topic']}): {entry['grade']}")
+                if info['average'] is not None:
+                    print(f"  Средний балл: {info['average']:.2f}, пропусков: {info['absences']}")
+                else:
+                    print(f"  Оценок нет, пропусков: {info['absences']}")
         elif choice == '3':
-            print(f"Группа: {journal.group}, Курс: {journal.course}")
+            print_schedule(journal.show_schedule())
         elif choice == '4':
+            print_schedule(journal.week_schedule())
+        elif choice == '5':
+            print_schedule(journal.next_pairs())
+        elif choice == '6':
+            print(f"Группа: {journal.group}, Курс: {journal.course}")
+        elif choice == '7':
+            journal.logout()
             break
         else:
             print("Некорректный выбор.")
 
+# --- Инструментирование ---
+class Instrumentation:
+    """Счетчики и гистограммы времени горячих участков: PBKDF2, Fernet, JSON, запись на диск.
+
+    Обертки ставятся поверх функций только при включении (enable_instrumentation),
+    поэтому в обычном режиме накладных расходов нет. Сводка выводится при выходе.
+    """
+
+    BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0)  # Верхние границы корзин гистограммы, секунды
+    BUCKET_LABELS = ('<0.1мс', '<1мс', '<10мс', '<100мс', '<1с', '>=1с')
+
+    def __init__(self, profile: str = None):
+        self.stats = {}  # имя -> [вызовов, всего секунд, максимум, [вызовов по корзинам]]
+        self.profile = profile
+        self.profiler = None
+        self._lock = threading.Lock()  # Fernet и PBKDF2 вызываются и из пулов потоков
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = [0, 0.0, 0.0, [0] * (len(self.BUCKETS) + 1)]
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+            stat[3][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def wrap(self, owner, attr: str, name: str):
+        """Заменяет owner.attr (функцию модуля или метод класса) оберткой с замером времени."""
+        original = owner.__dict__[attr] if isinstance(owner, type) else getattr(owner, attr)
+        is_static = isinstance(original, staticmethod)
+        func = original.__func__ if is_static else original
+        record, perf_counter = self.record, time.perf_counter
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - start)
+
+        setattr(owner, attr, staticmethod(timed) if is_static else timed)
+
+    def start_profile(self):
+        if self.profile == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.profile == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.start(25)
+
+    def report(self, stream=None):
+        """Выводит сводку (по умолчанию в stderr)."""
+        stream = stream or sys.stderr
+        print("\nИнструментирование: вызовов, всего с, среднее мс, максимум мс | " + ' '.join(self.BUCKET_LABELS),
+              file=stream)
+        for name, (count, total, peak, buckets) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            print(f"  {name:<26}{count:>8}{total:>10.3f}{total / count * 1000:>10.3f}{peak * 1000:>10.3f} | "
+                  + ' '.join(f"{n:>{len(label)}}" for n, label in zip(buckets, self.BUCKET_LABELS)), file=stream)
+
+        if self.profiler is not None:
+            import pstats
+            self.profiler.disable()
+            print("\nПрофиль cProfile (по суммарному времени):", file=stream)
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(25)
+        elif self.profile == 'tracemalloc':
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                print(f"\ntracemalloc: сейчас {current / 2**20:.1f} МБ, пик {peak / 2**20:.1f} МБ", file=stream)
+                for statistic in tracemalloc.take_snapshot().statistics('lineno')[:15]:
+                    print(f"  {statistic}", file=stream)
+
+
+instrumentation = None  # Instrumentation, если инструментирование включено
+
+
+def enable_instrumentation(profile: str = None):
+    """Включает счетчики и гистограммы (и профилирование: 'cprofile' или 'tracemalloc').
+
+    Также включается переменными окружения JOURNAL_INSTRUMENT (1, true или yes)
+    и JOURNAL_PROFILE (cprofile или tracemalloc).
+    Обертки ставятся только на функции и методы этого модуля; кодирование JSON
+    (json.encode, binary.encode) и запись с fsync (io.write) замеряются внутри
+    хранилищ одним замером на сохранение (см. _section).
+    """
+    global instrumentation
+    if instrumentation is not None:
+        return instrumentation
+    instrumentation = Instrumentation(profile)
+    module = sys.modules[__name__]
+    targets = [
+        (module, 'hash_password', 'pbkdf2'),
+        (EncryptionHelper, 'encrypt', 'fernet.encrypt'),
+        (EncryptionHelper, 'decrypt', 'fernet.decrypt'),
+        (EncryptionHelper, 'rotate', 'fernet.rotate'),
+        (Journal, '_load_data', 'journal.load'),
+        (Journal, '_save_data', 'journal.save'),
+        (Journal, '_append_log', 'journal.append_log'),
+        (Journal, '_commit', 'journal.commit'),
+    ]
+    for storage_class in (JsonStorage, BinaryStorage, SqliteStorage):
+        targets.append((storage_class, 'write_snapshot', f'{storage_class.__name__}.write_snapshot'))
+        targets.append((storage_class, 'save_teachers', f'{storage_class.__name__}.save_teachers'))
+    targets.append((SqliteStorage, 'apply_records', 'SqliteStorage.apply_records'))
+    for owner, attr, name in targets:
+        instrumentation.wrap(owner, attr, name)
+    instrumentation.start_profile()
+    atexit.register(instrumentation.report)
+    return instrumentation
+
+
+PROFILES = ('cprofile', 'tracemalloc')
+
+if parse_flag(os.environ.get('JOURNAL_INSTRUMENT', '')) or os.environ.get('JOURNAL_PROFILE') in PROFILES:
+    # Неизвестное значение JOURNAL_PROFILE (например, 0) профилирование не включает
+    enable_instrumentation(os.environ['JOURNAL_PROFILE'] if os.environ.get('JOURNAL_PROFILE') in PROFILES else None)
+
+
 # --- Запуск приложения ---
+STORAGES = {'json': JsonStorage, 'binary': BinaryStorage, 'sqlite': SqliteStorage}
+
+
+def main(argv=None):
+    """Разбирает аргументы командной строки и запускает нужный режим."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Электронный журнал группы")
+    parser.add_argument('--storage', choices=STORAGES,
+                        help="Формат хранения журнала (по умолчанию json; журнал группы - в том формате, "
+                             "в котором группа уже хранится)")
+    parser.add_argument('--journals-dir', default='journals', help="Каталог с журналами групп")
+    parser.add_argument('--key-file', help="Файл ключей шифрования (по умолчанию $JOURNAL_KEY_FILE или secret.key)")
+    parser.add_argument('--name-cache-size', type=int,
+                        help="Размер кеша расшифрованных имен (по умолчанию - под весь список группы)")
+    parser.add_argument('--name-index', action='store_true',
+                        help="Вести слепой индекс имен для поиска без расшифровки")
+    parser.add_argument('--record-encryption', action='store_true',
+                        help="Шифровать имена новых пользователей одним токеном на запись")
+    parser.add_argument('--instrument', action='store_true',
+                        help="Замерять PBKDF2, Fernet, кодирование JSON и запись на диск; сводка при выходе")
+    parser.add_argument('--profile', choices=PROFILES, help="Профилирование (включает --instrument)")
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('groups', help="Показать журналы групп")
+
+    convert = commands.add_parser('convert', help="Перенести журнал в другой формат хранения")
+    convert.add_argument('--to', choices=STORAGES, required=True, help="Целевой формат")
+    convert.add_argument('--group', help="Группа (без --group/--course переносится общий journal_data)")
+    convert.add_argument('--course', help="Курс")
+
+    for name, help_text in (('import', "Импортировать записи из CSV"), ('export', "Выгрузить записи в CSV")):
+        transfer = commands.add_parser(name, help=help_text)
+        transfer.add_argument('kind', choices=CSV_IMPORT_COLUMNS, help="Что переносить")
+        transfer.add_argument('path', help="CSV-файл")
+        transfer.add_argument('--group', required=True, help="Группа")
+        transfer.add_argument('--course', required=True, help="Курс")
+        transfer.add_argument('--login', required=True, help="Логин преподавателя")
+
+    rotate = commands.add_parser('rotate-key', help="Ввести новый ключ шифрования и перешифровать им данные")
+    rotate.add_argument('--drop-old-keys', action='store_true', help="Удалить прежние ключи после перешифровки")
+
+    migrate = commands.add_parser('migrate-names', help="Перевести сохраненные имена на один токен на запись")
+    migrate.add_argument('--per-field', action='store_true', help="Обратный перевод: токен на каждое поле имени")
+
+    serve = commands.add_parser('serve', help="Запустить HTTP/JSON-сервер журнала группы")
+    serve.add_argument('--group', required=True, help="Группа")
+    serve.add_argument('--course', required=True, help="Курс")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+
+    args = parser.parse_args(argv)
+    if args.key_file:
+        set_key_file(args.key_file)
+    if args.name_cache_size is not None:
+        Person.name_cache.resize(args.name_cache_size)
+    if args.instrument or args.profile:
+        enable_instrumentation(args.profile)
+    if args.command == 'groups':
+        for shard in ShardIndex(args.journals_dir).shards():
+            print(f"Группа: {shard['group']}, Курс: {shard['course']} - {shard['path']} "
+                  f"({ShardIndex.shard_format(shard)})")
+    elif args.command == 'convert':
+        if args.group is not None or args.course is not None:
+            # Журнал группы переносится из формата, в котором он хранится
+            shards = ShardIndex(args.journals_dir)
+            shard = shards.shard(args.group, args.course)
+            source_kind = ShardIndex.shard_format(shard) if shard is not None else 'json'
+            shards.convert(args.group, args.course, args.to)
+        else:
+            source_kind = args.storage or 'json'
+            convert_storage(STORAGES[source_kind](), STORAGES[args.to]())
+        print(f"Журнал перенесен из формата {source_kind} в формат {args.to}.")
+    elif args.command == 'rotate-key':
+        rotate_key(args.journals_dir, args.drop_old_keys)
+    elif args.command == 'migrate-names':
+        migrate_names(args.journals_dir, record_level=not args.per_field)
+    elif args.command in ('import', 'export'):
+        storage = _group_storage(args.journals_dir, args.group, args.course, args.storage)
+        if storage is None:
+            return
+        journal = Journal(group=args.group, course=args.course, use_wal=True, storage=storage,
+                          name_index=args.name_index, record_encryption=args.record_encryption)
+        if not journal.login(args.login, getpass.getpass("Пароль: ")) or not isinstance(journal.current_user, Teacher):
+            print("Неверный логин или пароль преподавателя!")
+            return
+        try:
+            if args.command == 'import':
+                count = import_csv(journal, args.kind, args.path)
+                print(f"Импортировано записей: {count}")
+            else:
+                count = export_csv(journal, args.kind, args.path)
+                print(f"Выгружено записей: {count}")
+        except OSError as e:
+            print(f"Ошибка при работе с файлом {args.path}: {e}")
+    elif args.command == 'serve':
+        storage = _group_storage(args.journals_dir, args.group, args.course, args.storage)
+        if storage is None:
+            return
+        journal = Journal(group=args.group, course=args.course, use_wal=True, storage=storage,
+                          name_index=args.name_index, record_encryption=args.record_encryption)
+        import asyncio
+
+        try:
+            asyncio.run(JournalServer(journal, args.host, args.port).serve_forever())
+        except KeyboardInterrupt:
+            print("Сервер остановлен.")
+    else:
+        main_menu(args.storage, args.journals_dir, args.name_index, args.record_encryption)
+
+
 if __name__ == "__main__":
-    main_menu()
\ No newline at end of file
+    main()
\ No newline at end of file